@@ -1,28 +1,35 @@
 # app/api.py - Enhanced API with database integration and security
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Request, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Request, Response, BackgroundTasks, Query as QueryParam
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, OAuth2PasswordRequestForm
+import asyncio
 import os
 import shutil
-import json
+import tempfile
 import time
+import orjson
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
-from app.embedding import create_faiss_index
+from app.embedding import encode_query_async, extract_chunks, index_documents
 from app.rag import get_answer
-from app.security import SecurityValidator, validate_upload_files
+from app.security import SecurityValidator, validate_upload_files, save_upload_file
 from app.file_processor import DocumentProcessor
-from app.database import get_db, Document, Query, User, Task, create_tables
-from app.utils import log_performance
+from app.database import (
+    get_db, get_read_db, Document, Query, User, Task, create_tables,
+    DOCUMENT_LISTING_METADATA, document_metadata_columns, document_hash_prefix_column
+)
+from app.utils import log_performance, conditional_response
 from app.auth import (
     get_current_user, get_current_active_user, require_admin,
     authenticate_user, create_access_token, get_password_hash,
     check_upload_rate_limit, check_query_rate_limit
 )
-from app.cache import query_cache, get_cache_stats, clear_all_cache
+from app.cache import query_cache, get_cache_stats, clear_all_cache, document_list_cache, cache_manager
+from app.search import invalidate_hybrid_searchers
 from app.monitoring import (
     monitor_operation, get_monitoring_dashboard, 
     log_security_event, monitor_performance
@@ -45,17 +52,21 @@ except ImportError:
 # Create database tables
 create_tables()
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 
 # Get project root and create uploads directory
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 UPLOAD_DIR = os.path.join(PROJECT_ROOT, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Files of one upload request extracted/indexed concurrently
+UPLOAD_CONCURRENCY = min(os.cpu_count() or 1, 4)
+
 @router.post("/upload")
 async def upload_files(files: List[UploadFile] = File(...), db: Session = Depends(get_db)):
     """Enhanced file upload with validation and database integration"""
-    start_time = time.time()
+    start_time = time.monotonic()
+    now = datetime.utcnow()
     
     try:
         # Validate files
@@ -65,72 +76,129 @@ async def upload_files(files: List[UploadFile] = File(...), db: Session = Depend
 
         uploaded_documents = []
         processing_errors = []
-
+        seen_hashes = set()
+        pending = []  # inserted documents waiting to be embedded and indexed
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        # Files are saved concurrently, so two that sanitize to the same
+        # name would overwrite each other; keep the first of each name
+        named_files = []
+        taken_names = set()
         for file in files:
-            try:
-                # Sanitize filename
-                safe_filename = SecurityValidator.sanitize_filename(file.filename)
-                file_path = os.path.join(UPLOAD_DIR, safe_filename)
-                
-                # Read file content for hash calculation
-                file_content = await file.read()
-                file_hash = SecurityValidator.calculate_file_hash(file_content)
-                
-                # Check for duplicate files
-                existing_doc = db.query(Document).filter(Document.file_hash == file_hash).first()
-                if existing_doc:
-                    processing_errors.append(f"File {file.filename} already exists (duplicate content)")
-                    continue
-                
-                # Save file
-                with open(file_path, "wb") as buffer:
-                    buffer.write(file_content)
-
-                # Process document and extract metadata
+            safe_filename = SecurityValidator.sanitize_filename(file.filename)
+            if safe_filename in taken_names:
+                processing_errors.append(f"File {file.filename} has the same name as another file in this upload")
+                continue
+            taken_names.add(safe_filename)
+            named_files.append((file, safe_filename))
+
+        async def _process_one(file: UploadFile, safe_filename: str):
+            # The session is only touched between awaits on the event loop
+            # thread; extraction and indexing run in worker threads
+            async with semaphore:
                 try:
-                    text, pdf_metadata = DocumentProcessor.extract_text_from_pdf(file_path)
-                    validation_result = DocumentProcessor.validate_document_content(text, pdf_metadata)
+                    file_path = os.path.join(UPLOAD_DIR, safe_filename)
                     
-                    # Create database record
-                    document = Document(
-                        filename=safe_filename,
-                        file_path=file_path,
-                        file_size=pdf_metadata.get("file_size", 0),
-                        page_count=pdf_metadata.get("page_count", 0),
-                        upload_date=datetime.utcnow(),
-                        file_hash=file_hash,
-                        metadata=json.dumps(pdf_metadata)
-                    )
+                    # Save and hash in one streaming pass to a file of its own; it
+                    # only replaces file_path once we know it isn't a duplicate
+                    partial_fd, partial_path = tempfile.mkstemp(suffix=".part", dir=UPLOAD_DIR)
+                    os.close(partial_fd)
+                    try:
+                        file_hash = await save_upload_file(file, partial_path)
+                    except Exception:
+                        os.remove(partial_path)
+                        raise
                     
-                    db.add(document)
-                    db.flush()  # Get the document ID
+                    # Check for duplicate files (including other files of this request, not yet committed)
+                    if file_hash in seen_hashes or db.query(Document.id).filter(Document.file_hash == file_hash).first():
+                        os.remove(partial_path)
+                        processing_errors.append(f"File {file.filename} already exists (duplicate content)")
+                        return
                     
-                    # Create FAISS index
-                    chunk_count = create_faiss_index(file_path, document.id)
-                    
-                    # Update chunk count
-                    document.chunk_count = chunk_count
-                    db.commit()
-
-                    uploaded_documents.append({
-                        "id": document.id,
-                        "filename": safe_filename,
-                        "chunks": chunk_count,
-                        "pages": pdf_metadata.get("page_count", 0),
-                        "file_size": pdf_metadata.get("file_size", 0),
-                        "warnings": validation_result.get("warnings", [])
-                    })
+                    seen_hashes.add(file_hash)
+                    os.replace(partial_path, file_path)
+
+                    # Process document and extract metadata
+                    try:
+                        text, pdf_metadata = await asyncio.to_thread(
+                            DocumentProcessor.extract_text_from_pdf, file_path, file_hash
+                        )
+                        validation_result = DocumentProcessor.validate_document_content(text, pdf_metadata)
+                        
+                        # Create database record
+                        document = Document(
+                            filename=safe_filename,
+                            file_path=file_path,
+                            file_size=pdf_metadata.get("file_size", 0),
+                            page_count=pdf_metadata.get("page_count", 0),
+                            upload_date=now,
+                            file_hash=file_hash,
+                            file_metadata=pdf_metadata
+                        )
+                        
+                        # Savepoint per file so a failure only undoes this document;
+                        # everything is committed once after all files are done
+                        with db.begin_nested():
+                            db.add(document)  # flushed on release, which assigns the ID
+                        
+                        # Chunk now, embed and index all files together below
+                        # (scanned documents have no text to index)
+                        try:
+                            if pdf_metadata.get("scanned_only"):
+                                chunks = []
+                            else:
+                                chunks = await asyncio.to_thread(extract_chunks, file_path, "word", text)
+                        except Exception:
+                            with db.begin_nested():
+                                db.delete(document)
+                            raise
+                        
+                        pending.append((file, document, file_path, chunks, pdf_metadata, validation_result))
+
+                    except Exception as e:
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+                        processing_errors.append(f"Failed to process {file.filename}: {str(e)}")
 
                 except Exception as e:
-                    db.rollback()
+                    processing_errors.append(f"Failed to upload {file.filename}: {str(e)}")
+
+        await asyncio.gather(*(_process_one(file, safe_filename) for file, safe_filename in named_files))
+
+        # One embedding batch and one FAISS add for every file in the request
+        if pending:
+            try:
+                chunk_counts = await asyncio.to_thread(
+                    index_documents, [(file_path, document.id, chunks) for _, document, file_path, chunks, _, _ in pending]
+                )
+            except Exception as e:
+                for file, document, file_path, _, _, _ in pending:
+                    with db.begin_nested():
+                        db.delete(document)
                     if os.path.exists(file_path):
                         os.remove(file_path)
                     processing_errors.append(f"Failed to process {file.filename}: {str(e)}")
+                pending, chunk_counts = [], []
+
+            for (file, document, file_path, _, pdf_metadata, validation_result), chunk_count in zip(pending, chunk_counts):
+                # Update chunk count
+                document.chunk_count = chunk_count
+
+                uploaded_documents.append({
+                    "id": document.id,
+                    "filename": document.filename,
+                    "chunks": chunk_count,
+                    "pages": pdf_metadata.get("page_count", 0),
+                    "file_size": pdf_metadata.get("file_size", 0),
+                    "warnings": validation_result.get("warnings", [])
+                })
+
+        if uploaded_documents:
+            db.commit()
+            document_list_cache.invalidate()
+            invalidate_hybrid_searchers()
 
-            except Exception as e:
-                processing_errors.append(f"Failed to upload {file.filename}: {str(e)}")
-
-        duration = time.time() - start_time
+        duration = time.monotonic() - start_time
         log_performance("FILE_UPLOAD", duration, files=len(files), successful=len(uploaded_documents))
 
         response_data = {
@@ -152,45 +220,49 @@ async def upload_files(files: List[UploadFile] = File(...), db: Session = Depend
 @router.post("/query")
 async def query_documents(query: str = Form(...), k: int = Form(3), db: Session = Depends(get_db)):
     """Enhanced document querying with database logging"""
-    start_time = time.time()
+    start_time = time.monotonic()
     
     try:
         # Validate query
         if not SecurityValidator.validate_query(query):
             return JSONResponse(status_code=400, content={"error": "Invalid query format or content"})
 
-        # Get all documents from database
-        documents = db.query(Document).all()
+        # Get all documents (ids and paths only, cached between uploads)
+        document_ids, doc_paths = document_list_cache.get_accessible(db, all_documents=True)
         
-        if not documents:
+        if not document_ids:
             return JSONResponse(status_code=400, content={"error": "No documents uploaded yet."})
-
-        # Prepare document paths
-        doc_paths = [doc.file_path for doc in documents]
         
         try:
-            # Get answer from RAG system
-            answer = get_answer(query, doc_paths, k=k)
+            # Identical query over the same documents: reuse the stored answer
+            answer = cache_manager.get_cached_response(query, document_ids, k, db)
+            if answer is None:
+                # Get answer from RAG system
+                query_embedding = await encode_query_async(query)
+                # Corpus loads/saves and the LLM call block; keep them off the event loop
+                answer = await asyncio.to_thread(get_answer, query, doc_paths, k=k, document_ids=document_ids,
+                                                 query_embedding=query_embedding)
+                cache_manager.cache_response(query, answer, document_ids, k, db)
             
             # Log query to database
             query_record = Query(
                 query_text=query,
                 response_text=answer,
-                processing_time=time.time() - start_time,
-                documents_used=json.dumps([doc.id for doc in documents]),
+                processing_time=time.monotonic() - start_time,
+                documents_used=orjson.dumps(document_ids).decode(),
                 timestamp=datetime.utcnow()
             )
             
             db.add(query_record)
             db.commit()
             
-            duration = time.time() - start_time
-            log_performance("QUERY_PROCESSING", duration, documents=len(documents))
+            duration = time.monotonic() - start_time
+            log_performance("QUERY_PROCESSING", duration, documents=len(document_ids))
 
             return {
                 "query": query,
                 "answer": answer,
-                "documents_searched": len(documents),
+                "documents_searched": len(document_ids),
                 "processing_time": round(duration, 3),
                 "query_id": query_record.id
             }
@@ -201,46 +273,83 @@ async def query_documents(query: str = Form(...), k: int = Form(3), db: Session
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Query failed: {str(e)}"})
 
-@router.get("/documents")
-async def list_documents(db: Session = Depends(get_db)):
-    """Enhanced document listing with comprehensive metadata"""
-    try:
-        documents = db.query(Document).order_by(Document.upload_date.desc()).all()
-        
-        document_list = []
-        for doc in documents:
-            metadata = json.loads(doc.file_metadata) if doc.file_metadata else {}
-            
-            document_list.append({
+def _stream_document_list(bind, statement, trailer: Dict[str, Any]):
+    """Yield {"documents": [...], **trailer} as JSON, one row at a time"""
+    with Session(bind) as db:
+        yield b'{"documents":['
+        for index, doc in enumerate(db.execute(statement.execution_options(yield_per=200))):
+            if index:
+                yield b","
+            yield orjson.dumps({
                 "id": doc.id,
                 "filename": doc.filename,
                 "upload_date": doc.upload_date.isoformat(),
                 "file_size": doc.file_size,
                 "page_count": doc.page_count,
                 "chunk_count": doc.chunk_count,
-                "file_hash": doc.file_hash[:16] + "...",  # Truncated hash for security
-                "metadata": {
-                    "title": metadata.get("title", ""),
-                    "author": metadata.get("author", ""),
-                    "creation_date": metadata.get("creation_date", ""),
-                    "extractable_pages": metadata.get("extractable_pages", 0),
-                    "total_text_length": metadata.get("total_text_length", 0)
-                }
+                "file_hash": f"{doc.hash_prefix}...",  # Truncated hash for security
+                "metadata": {key: getattr(doc, key) for key in DOCUMENT_LISTING_METADATA}
             })
+        yield b"]," + orjson.dumps(trailer)[1:]
+
+@router.get("/documents")
+async def list_documents(
+    request: Request,
+    response: Response,
+    skip: int = QueryParam(0),
+    limit: int = QueryParam(100),
+    db: Session = Depends(get_read_db)
+):
+    """Enhanced document listing with comprehensive metadata"""
+    try:
+        # Totals double as a cheap fingerprint; unchanged means the client's copy is current
+        total_count, max_id, last_upload, total_pages, total_chunks = db.query(
+            func.count(Document.id), func.max(Document.id), func.max(Document.upload_date),
+            func.coalesce(func.sum(Document.page_count), 0), func.coalesce(func.sum(Document.chunk_count), 0)
+        ).one()
+        not_modified = conditional_response(
+            request, response, skip, limit, total_count, max_id, last_upload, total_chunks
+        )
+        if not_modified:
+            return not_modified
         
-        return {
-            "documents": document_list,
-            "total_count": len(document_list),
-            "total_pages": sum(doc["page_count"] for doc in document_list),
-            "total_chunks": sum(doc["chunk_count"] for doc in document_list)
+        statement = select(
+            Document.id, Document.filename, Document.upload_date, Document.file_size,
+            Document.page_count, Document.chunk_count, document_hash_prefix_column(),
+            *document_metadata_columns()
+        ).order_by(Document.upload_date.desc()).offset(skip).limit(limit)
+        
+        trailer = {
+            "total_count": total_count,
+            "total_pages": total_pages,
+            "total_chunks": total_chunks,
+            "showing": max(min(limit, total_count - skip), 0),
+            "skip": skip,
+            "limit": limit
         }
         
+        # Rows are streamed on their own session: the request's session is
+        # closed by the dependency before the body is sent
+        return StreamingResponse(
+            _stream_document_list(db.get_bind(), statement, trailer),
+            media_type="application/json",
+            headers=dict(response.headers)
+        )
+        
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Failed to list documents: {str(e)}"})
 
+# Health is polled continuously; reuse a healthy result for this many seconds
+HEALTH_CACHE_TTL = 1.0
+_health_snapshot = {"expires": 0.0, "payload": None}
+
 @router.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Health check endpoint"""
+    if _health_snapshot["payload"] and time.monotonic() < _health_snapshot["expires"]:
+        payload = _health_snapshot["payload"]
+        return conditional_response(request, response, payload["timestamp"], max_age=1) or payload
+    
     try:
         # Check database connection
         document_count = db.query(Document).count()
@@ -252,7 +361,7 @@ async def health_check(db: Session = Depends(get_db)):
         indexes_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexes")
         indexes_exist = os.path.exists(indexes_dir)
         
-        return {
+        payload = {
             "status": "healthy",
             "database_connected": True,
             "uploads_directory": uploads_exist,
@@ -260,6 +369,9 @@ async def health_check(db: Session = Depends(get_db)):
             "total_documents": document_count,
             "timestamp": datetime.utcnow().isoformat()
         }
+        _health_snapshot.update(payload=payload, expires=time.monotonic() + HEALTH_CACHE_TTL)
+        
+        return conditional_response(request, response, payload["timestamp"], max_age=1) or payload
         
     except Exception as e:
         return JSONResponse(status_code=503, content={
@@ -269,22 +381,29 @@ async def health_check(db: Session = Depends(get_db)):
         })
 
 @router.get("/stats")
-async def get_statistics(db: Session = Depends(get_db)):
+async def get_statistics(db: Session = Depends(get_read_db)):
     """Get system statistics"""
     try:
-        documents = db.query(Document).all()
-        queries = db.query(Query).all()
+        document_count, total_pages, total_chunks, total_size = db.query(
+            func.count(Document.id),
+            func.coalesce(func.sum(Document.page_count), 0),
+            func.coalesce(func.sum(Document.chunk_count), 0),
+            func.coalesce(func.sum(Document.file_size), 0)
+        ).one()
+        query_count, avg_processing_time = db.query(
+            func.count(Query.id), func.coalesce(func.avg(Query.processing_time), 0)
+        ).one()
         
         return {
             "documents": {
-                "total": len(documents),
-                "total_pages": sum(doc.page_count for doc in documents),
-                "total_chunks": sum(doc.chunk_count for doc in documents),
-                "total_size_bytes": sum(doc.file_size for doc in documents)
+                "total": document_count,
+                "total_pages": total_pages,
+                "total_chunks": total_chunks,
+                "total_size_bytes": total_size
             },
             "queries": {
-                "total": len(queries),
-                "average_processing_time": sum(q.processing_time for q in queries) / len(queries) if queries else 0
+                "total": query_count,
+                "average_processing_time": avg_processing_time
             },
             "system": {
                 "uploads_directory": UPLOAD_DIR,
@@ -484,6 +603,7 @@ async def submit_task(
     current_user: User = Depends(get_current_active_user)
 ):
     """Submit a new task for processing"""
+    now = datetime.utcnow()
     task = {
         "query": query,
         "k": k,
@@ -491,8 +611,8 @@ async def submit_task(
         "status": "pending",
         "result": None,
         "error": None,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
     
     # Add task to database
@@ -612,7 +732,7 @@ async def monitor_perf(
     return {"detail": "Performance monitored"}
 
 @router.get("/document/{document_id}")
-async def get_document_details(document_id: int, db: Session = Depends(get_db)):
+async def get_document_details(document_id: int, db: Session = Depends(get_read_db)):
     """Get detailed information about a specific document"""
     try:
         document = db.query(Document).filter(Document.id == document_id).first()
@@ -620,7 +740,7 @@ async def get_document_details(document_id: int, db: Session = Depends(get_db)):
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        metadata = json.loads(document.file_metadata) if document.file_metadata else {}
+        metadata = document.file_metadata or {}
         
         return {
             "id": document.id,
@@ -660,7 +780,7 @@ def process_query_task(task_id: str, query: str, document_paths: List[str], k: i
         
         # Update task with result
         if task:
-            task.result = json.dumps({"answer": answer})
+            task.result = orjson.dumps({"answer": answer}).decode()
             task.state = "completed"
             task.completed_at = datetime.utcnow()
             task.progress = 100.0
@@ -1,38 +1,45 @@
 # app/api_enhanced.py - Enhanced API with all advanced features
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Request, Query as QueryParam
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Request, Response, BackgroundTasks, Query as QueryParam
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.security import HTTPBearer
 import os
 import shutil
-import json
 import time
+import asyncio
+import orjson
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Import all our enhanced modules
-from app.database import get_db, Document, Query, User, APIKey, create_tables
+from app.database import (
+    get_db, get_async_db, Document, Query, User, APIKey, create_tables,
+    DOCUMENT_LISTING_METADATA, document_metadata_columns, document_hash_prefix_column
+)
 from app.auth import (
     get_current_user_or_api_key, get_current_user, require_admin,
-    create_access_token, hash_password, verify_password, generate_api_key, hash_api_key,
+    create_access_token, hash_password, verify_password, generate_api_key, hash_api_key, update_last_login,
     check_upload_rate_limit, check_query_rate_limit
 )
-from app.cache import cache_manager, embedding_cache, document_cache
+from app.cache import cache_manager, embedding_cache, document_cache, semantic_query_cache, document_list_cache
+from app.search import invalidate_hybrid_searchers
 from app.monitoring import performance_timer, log_to_database, performance_monitor, system_monitor, error_tracker
 from app.search import hybrid_searcher, query_expander, reranker
 from app.async_processing import task_manager, schedule_document_processing, schedule_complex_query
-from app.security import SecurityValidator, validate_upload_files
-from app.file_processor import DocumentProcessor
-from app.embedding import create_faiss_index
+from app.security import SecurityValidator, validate_upload_files, save_upload_file
+from app.file_processor import DocumentProcessor, evict_extract_cache
+from app.embedding import corpus_index, encode_query_async
 from app.rag import get_answer
-from app.utils import log_performance
+from app.utils import log_performance, conditional_response
 from app.config import settings
 
 # Create database tables
 create_tables()
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 security = HTTPBearer()
 
 # Get project root and create directories
@@ -97,29 +104,30 @@ async def register_user(
 
 @router.post("/auth/login")
 async def login_user(
+    background_tasks: BackgroundTasks,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Login user and return access token"""
     try:
         # Find user
-        user = db.query(User).filter(User.username == username).first()
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalar_one_or_none()
         
-        if not user or not verify_password(password, user.hashed_password):
+        # bcrypt is deliberately slow; keep it off the event loop
+        if not user or not await asyncio.to_thread(verify_password, password, user.hashed_password):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         if not user.is_active:
             raise HTTPException(status_code=401, detail="Account is disabled")
         
-        # Update last login
-        user.last_login = datetime.utcnow()
-        db.commit()
-        
         # Create access token
         access_token = create_access_token(user.id, user.username, user.role)
         
-        log_to_database("INFO", f"User logged in: {username}", "AUTH", user.id)
+        # last_login and the audit entry don't need to block the response
+        background_tasks.add_task(update_last_login, user.id, datetime.utcnow())
+        background_tasks.add_task(log_to_database, "INFO", f"User logged in: {username}", "AUTH", user.id)
         
         return {
             "access_token": access_token,
@@ -182,13 +190,18 @@ async def create_api_key(
 async def upload_files(
     request: Request,
     files: List[UploadFile] = File(...),
-    async_processing: bool = Form(False),
+    sync: bool = QueryParam(False),
     current_user: Optional[User] = Depends(get_current_user_or_api_key),
     db: Session = Depends(get_db),
     _rate_limit: None = Depends(check_upload_rate_limit)
 ):
-    """Enhanced file upload with authentication and async processing"""
-    start_time = time.time()
+    """Enhanced file upload with authentication; indexing always runs as a background task.
+    
+    Returns 202 Accepted with a task_id per document to poll at /upload/status/{task_id}.
+    ``sync=true`` waits for the indexing tasks and returns 200 (intended for tests).
+    """
+    start_time = time.monotonic()
+    now = datetime.utcnow()
     
     try:
         # Validate files
@@ -198,6 +211,8 @@ async def upload_files(
 
         uploaded_documents = []
         processing_errors = []
+        new_documents = []
+        seen_hashes = set()
 
         for file in files:
             try:
@@ -205,23 +220,23 @@ async def upload_files(
                 safe_filename = SecurityValidator.sanitize_filename(file.filename)
                 file_path = os.path.join(UPLOAD_DIR, safe_filename)
                 
-                # Read file content for hash calculation
-                file_content = await file.read()
-                file_hash = SecurityValidator.calculate_file_hash(file_content)
+                # Save and hash in one streaming pass; the partial file only
+                # replaces file_path once we know it isn't a duplicate
+                partial_path = file_path + ".part"
+                file_hash = await save_upload_file(file, partial_path)
                 
-                # Check for duplicate files
-                existing_doc = db.query(Document).filter(Document.file_hash == file_hash).first()
-                if existing_doc:
+                # Check for duplicate files (including earlier files of this request, not yet committed)
+                if file_hash in seen_hashes or db.query(Document.id).filter(Document.file_hash == file_hash).first():
+                    os.remove(partial_path)
                     processing_errors.append(f"File {file.filename} already exists (duplicate content)")
                     continue
                 
-                # Save file
-                with open(file_path, "wb") as buffer:
-                    buffer.write(file_content)
+                seen_hashes.add(file_hash)
+                os.replace(partial_path, file_path)
 
                 # Extract basic metadata first
                 try:
-                    _, pdf_metadata = DocumentProcessor.extract_text_from_pdf(file_path)
+                    _, pdf_metadata = DocumentProcessor.extract_text_from_pdf(file_path, file_hash=file_hash)
                     
                     # Create database record
                     document = Document(
@@ -229,45 +244,18 @@ async def upload_files(
                         file_path=file_path,
                         file_size=pdf_metadata.get("file_size", 0),
                         page_count=pdf_metadata.get("page_count", 0),
-                        upload_date=datetime.utcnow(),
+                        upload_date=now,
                         file_hash=file_hash,
-                        metadata=json.dumps(pdf_metadata),
+                        file_metadata=pdf_metadata,
                         owner_id=current_user.id if current_user else None
                     )
                     
-                    db.add(document)
-                    db.flush()  # Get the document ID
-                    
-                    if async_processing:
-                        # Schedule async processing
-                        task_id = await schedule_document_processing(file_path, document.id)
-                        
-                        uploaded_documents.append({
-                            "id": document.id,
-                            "filename": safe_filename,
-                            "task_id": task_id,
-                            "status": "processing",
-                            "pages": pdf_metadata.get("page_count", 0),
-                            "file_size": pdf_metadata.get("file_size", 0)
-                        })
-                    else:
-                        # Process synchronously
-                        chunk_count = create_faiss_index(file_path, document.id)
-                        document.chunk_count = chunk_count
-                        
-                        uploaded_documents.append({
-                            "id": document.id,
-                            "filename": safe_filename,
-                            "chunks": chunk_count,
-                            "pages": pdf_metadata.get("page_count", 0),
-                            "file_size": pdf_metadata.get("file_size", 0),
-                            "status": "completed"
-                        })
-                    
-                    db.commit()
+                    # Savepoint per file so one failed insert doesn't undo the others
+                    with db.begin_nested():
+                        db.add(document)
+                    new_documents.append((document, safe_filename, file_path, pdf_metadata))
 
                 except Exception as e:
-                    db.rollback()
                     if os.path.exists(file_path):
                         os.remove(file_path)
                     processing_errors.append(f"Failed to process {file.filename}: {str(e)}")
@@ -275,21 +263,55 @@ async def upload_files(
             except Exception as e:
                 processing_errors.append(f"Failed to upload {file.filename}: {str(e)}")
 
-        duration = time.time() - start_time
+        if new_documents:
+            # One commit for the whole upload, before the indexing tasks look the rows up
+            db.commit()
+            semantic_query_cache.clear()
+            document_list_cache.invalidate()
+            invalidate_hybrid_searchers()
+        
+        for document, safe_filename, file_path, pdf_metadata in new_documents:
+            task_id = await schedule_document_processing(file_path, document.id)
+            
+            uploaded_documents.append({
+                "id": document.id,
+                "filename": safe_filename,
+                "task_id": task_id,
+                "status": "processing",
+                "pages": pdf_metadata.get("page_count", 0),
+                "file_size": pdf_metadata.get("file_size", 0)
+            })
+
+        if sync:
+            for uploaded in uploaded_documents:
+                task = await task_manager.wait_for_task(uploaded["task_id"], timeout=settings.sync_upload_timeout)
+                uploaded["status"] = task.status.value if task else "failed"
+                if task and task.result:
+                    uploaded["chunks"] = task.result["chunks_created"]
+                elif task and task.error:
+                    processing_errors.append(f"Failed to index {uploaded['filename']}: {task.error}")
+
+        duration = time.monotonic() - start_time
         log_performance("FILE_UPLOAD", duration, files=len(files), successful=len(uploaded_documents))
 
         response_data = {
-            "status": "completed",
+            "status": "completed" if sync else "accepted",
             "uploaded": uploaded_documents,
             "total_uploaded": len(uploaded_documents),
             "processing_time": round(duration, 3),
-            "async_processing": async_processing
+            "async_processing": not sync
         }
         
         if processing_errors:
             response_data["errors"] = processing_errors
-            
-        return response_data
+        
+        if sync or not uploaded_documents:
+            return response_data
+        
+        headers = {}
+        if len(uploaded_documents) == 1:
+            headers["Location"] = str(request.url_for("get_upload_status", task_id=uploaded_documents[0]["task_id"]))
+        return ORJSONResponse(status_code=202, content=response_data, headers=headers)
 
     except Exception as e:
         db.rollback()
@@ -302,7 +324,7 @@ async def get_upload_status(
     current_user: Optional[User] = Depends(get_current_user_or_api_key)
 ):
     """Get status of async upload task"""
-    task = task_manager.get_task(task_id)
+    task = await task_manager.get_task_async(task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -326,25 +348,20 @@ async def query_documents(
     _rate_limit: None = Depends(check_query_rate_limit)
 ):
     """Enhanced document querying with advanced search options"""
-    start_time = time.time()
+    start_time = time.monotonic()
     
     try:
         # Validate query
         if not SecurityValidator.validate_query(query):
             return JSONResponse(status_code=400, content={"error": "Invalid query format or content"})
 
-        # Get accessible documents
-        if current_user:
-            documents = db.query(Document).filter(
-                (Document.owner_id == current_user.id) | (Document.is_public == True)
-            ).all()
-        else:
-            documents = db.query(Document).filter(Document.is_public == True).all()
+        # Get accessible documents (ids and paths only, cached between uploads)
+        document_ids, doc_paths = document_list_cache.get_accessible(
+            db, current_user.id if current_user else None
+        )
         
-        if not documents:
+        if not document_ids:
             return JSONResponse(status_code=400, content={"error": "No accessible documents found"})
-
-        document_ids = [doc.id for doc in documents]
         
         # Check cache first
         cached_response = None
@@ -355,7 +372,7 @@ async def query_documents(
             return {
                 "query": query,
                 "answer": cached_response,
-                "documents_searched": len(documents),
+                "documents_searched": len(document_ids),
                 "processing_time": 0.001,
                 "cached": True,
                 "search_type": "cached"
@@ -369,7 +386,7 @@ async def query_documents(
                 "query": query,
                 "task_id": task_id,
                 "status": "processing",
-                "documents_to_search": len(documents),
+                "documents_to_search": len(document_ids),
                 "search_type": search_type
             }
         
@@ -380,9 +397,25 @@ async def query_documents(
             if expand_query:
                 processed_query = query_expander.expand_query(query)
             
-            # Get answer from RAG system
-            doc_paths = [doc.file_path for doc in documents]
-            answer = get_answer(processed_query, doc_paths, k=k)
+            # Encoded with other in-flight queries' text in one model call
+            query_embedding = await encode_query_async(processed_query)
+            
+            # Near-duplicate of an answered query? Reuse its answer and skip the LLM call
+            use_semantic_cache = use_cache and settings.enable_semantic_cache
+            semantic_hit = None
+            if use_semantic_cache:
+                cache_scope = semantic_query_cache.scope_key(document_ids, k)
+                semantic_hit = semantic_query_cache.get(query_embedding[0], cache_scope)
+            
+            if semantic_hit:
+                answer, _ = semantic_hit
+            else:
+                # Get answer from RAG system (corpus loads/saves and the LLM call
+                # block, so they run in a worker thread)
+                answer = await asyncio.to_thread(
+                    get_answer, processed_query, doc_paths, k=k,
+                    document_ids=document_ids, query_embedding=query_embedding
+                )
             
             # Cache the response
             if use_cache:
@@ -392,8 +425,8 @@ async def query_documents(
             query_record = Query(
                 query_text=query,
                 response_text=answer,
-                processing_time=time.time() - start_time,
-                documents_used=json.dumps(document_ids),
+                processing_time=time.monotonic() - start_time,
+                documents_used=orjson.dumps(document_ids).decode(),
                 timestamp=datetime.utcnow(),
                 user_id=current_user.id if current_user else None,
                 search_type=search_type
@@ -402,18 +435,21 @@ async def query_documents(
             db.add(query_record)
             db.commit()
             
-            duration = time.time() - start_time
-            log_performance("QUERY_PROCESSING", duration, documents=len(documents))
+            if use_semantic_cache and not semantic_hit:
+                semantic_query_cache.put(query_embedding[0], answer, query_record.id, cache_scope)
+            
+            duration = time.monotonic() - start_time
+            log_performance("QUERY_PROCESSING", duration, documents=len(document_ids))
 
             return {
                 "query": query,
                 "processed_query": processed_query if expand_query else None,
                 "answer": answer,
-                "documents_searched": len(documents),
+                "documents_searched": len(document_ids),
                 "processing_time": round(duration, 3),
                 "query_id": query_record.id,
                 "search_type": search_type,
-                "cached": False
+                "cached": bool(semantic_hit)
             }
             
         except Exception as e:
@@ -437,7 +473,7 @@ async def get_query_status(
     current_user: Optional[User] = Depends(get_current_user_or_api_key)
 ):
     """Get status of async query task"""
-    task = task_manager.get_task(task_id)
+    task = await task_manager.get_task_async(task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -448,36 +484,53 @@ async def get_query_status(
 
 @router.get("/documents")
 async def list_documents(
+    request: Request,
+    response: Response,
     skip: int = QueryParam(0),
     limit: int = QueryParam(100),
     owner_only: bool = QueryParam(False),
     current_user: Optional[User] = Depends(get_current_user_or_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Enhanced document listing with pagination and filtering"""
     try:
-        query = db.query(Document)
-        
         # Filter by access permissions
         if current_user:
             if owner_only:
-                query = query.filter(Document.owner_id == current_user.id)
+                visible = Document.owner_id == current_user.id
             else:
-                query = query.filter(
-                    (Document.owner_id == current_user.id) | (Document.is_public == True)
-                )
+                visible = (Document.owner_id == current_user.id) | (Document.is_public == True)
         else:
-            query = query.filter(Document.is_public == True)
-        
-        # Apply pagination
-        documents = query.order_by(Document.upload_date.desc()).offset(skip).limit(limit).all()
-        total_count = query.count()
+            visible = Document.is_public == True
+        
+        # Cheap fingerprint of the visible rows; unchanged means the client's copy is current
+        fingerprint = await db.execute(
+            select(
+                func.count(Document.id), func.max(Document.id),
+                func.max(Document.upload_date), func.sum(Document.chunk_count)
+            ).where(visible)
+        )
+        total_count, max_id, last_upload, chunk_total = fingerprint.one()
+        not_modified = conditional_response(
+            request, response,
+            current_user.id if current_user else None, owner_only, skip, limit,
+            total_count, max_id, last_upload, chunk_total
+        )
+        if not_modified:
+            return not_modified
+        
+        # Apply pagination, projecting only the listed columns
+        result = await db.execute(
+            select(
+                Document.id, Document.filename, Document.upload_date, Document.file_size,
+                Document.page_count, Document.chunk_count, Document.is_public, Document.owner_id,
+                document_hash_prefix_column(), *document_metadata_columns()
+            ).where(visible).order_by(Document.upload_date.desc()).offset(skip).limit(limit)
+        )
+        documents = result.all()
         
-        document_list = []
-        for doc in documents:
-            metadata = json.loads(doc.file_metadata) if doc.file_metadata else {}
-            
-            document_list.append({
+        document_list = [
+            {
                 "id": doc.id,
                 "filename": doc.filename,
                 "upload_date": doc.upload_date.isoformat(),
@@ -486,15 +539,11 @@ async def list_documents(
                 "chunk_count": doc.chunk_count,
                 "is_public": doc.is_public,
                 "owner_id": doc.owner_id,
-                "file_hash": doc.file_hash[:16] + "...",
-                "metadata": {
-                    "title": metadata.get("title", ""),
-                    "author": metadata.get("author", ""),
-                    "creation_date": metadata.get("creation_date", ""),
-                    "extractable_pages": metadata.get("extractable_pages", 0),
-                    "total_text_length": metadata.get("total_text_length", 0)
-                }
-            })
+                "file_hash": f"{doc.hash_prefix}...",
+                "metadata": {key: getattr(doc, key) for key in DOCUMENT_LISTING_METADATA}
+            }
+            for doc in documents
+        ]
         
         return {
             "documents": document_list,
@@ -526,9 +575,10 @@ async def delete_document(
         if current_user.role != "admin" and document.owner_id != current_user.id:
             raise HTTPException(status_code=403, detail="Not authorized to delete this document")
         
-        # Remove file
+        # Remove file and its cached extraction
         if os.path.exists(document.file_path):
             os.remove(document.file_path)
+        evict_extract_cache(document.file_hash)
         
         # Remove from database
         db.delete(document)
@@ -536,6 +586,10 @@ async def delete_document(
         
         # Invalidate cache
         cache_manager.invalidate_document_cache([document_id], db)
+        semantic_query_cache.clear()
+        document_list_cache.invalidate()
+        invalidate_hybrid_searchers()
+        corpus_index.remove_document(document_id)
         
         log_to_database("INFO", f"Document deleted: {document.filename}", "DOCUMENT", current_user.id)
         
@@ -623,7 +677,7 @@ async def get_system_logs(
             
             if log.log_metadata:
                 try:
-                    log_data["metadata"] = json.loads(log.log_metadata)
+                    log_data["metadata"] = orjson.loads(log.log_metadata)
                 except:
                     log_data["metadata"] = {}
             
@@ -642,26 +696,39 @@ async def get_system_logs(
 # ===================== MONITORING ENDPOINTS =====================
 
 @router.get("/health")
-async def health_check():
+async def health_check(request: Request, response: Response):
     """Comprehensive health check"""
-    return system_monitor.health_check()
+    health = system_monitor.cached_health_check()
+    return conditional_response(request, response, health["timestamp"], max_age=1) or health
 
 @router.get("/stats")
 async def get_statistics(
     current_user: Optional[User] = Depends(get_current_user_or_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get comprehensive system statistics"""
     try:
-        # Basic stats
+        # Basic stats, aggregated in SQL
         if current_user:
-            documents = db.query(Document).filter(
-                (Document.owner_id == current_user.id) | (Document.is_public == True)
-            ).all()
-            queries = db.query(Query).filter(Query.user_id == current_user.id).all()
+            visible = (Document.owner_id == current_user.id) | (Document.is_public == True)
         else:
-            documents = db.query(Document).filter(Document.is_public == True).all()
-            queries = []
+            visible = Document.is_public == True
+        
+        document_totals = (await db.execute(
+            select(
+                func.count(Document.id),
+                func.coalesce(func.sum(Document.page_count), 0),
+                func.coalesce(func.sum(Document.chunk_count), 0),
+                func.coalesce(func.sum(Document.file_size), 0)
+            ).where(visible)
+        )).one()
+        
+        query_count, avg_query_time = 0, 0
+        if current_user:
+            query_count, avg_query_time = (await db.execute(
+                select(func.count(Query.id), func.coalesce(func.avg(Query.processing_time), 0))
+                .where(Query.user_id == current_user.id)
+            )).one()
         
         # Performance metrics
         perf_stats = {}
@@ -669,18 +736,18 @@ async def get_statistics(
             perf_stats[metric_name] = performance_monitor.get_statistics(metric_name)
         
         # Cache stats
-        cache_stats = cache_manager.get_cache_stats(db)
+        cache_stats = await db.run_sync(cache_manager.get_cache_stats)
         embedding_cache_stats = embedding_cache.stats()
         document_cache_stats = document_cache.stats()
         
         # Task stats
-        all_tasks = task_manager.get_all_tasks()
+        status_counts = await asyncio.to_thread(task_manager.get_status_counts)
         task_stats = {
-            "total": len(all_tasks),
-            "pending": len([t for t in all_tasks if t.status.value == "pending"]),
-            "running": len([t for t in all_tasks if t.status.value == "running"]),
-            "completed": len([t for t in all_tasks if t.status.value == "completed"]),
-            "failed": len([t for t in all_tasks if t.status.value == "failed"])
+            "total": sum(status_counts.values()),
+            "pending": status_counts["pending"],
+            "running": status_counts["running"],
+            "completed": status_counts["completed"],
+            "failed": status_counts["failed"]
         }
         
         # Error stats
@@ -688,14 +755,14 @@ async def get_statistics(
         
         return {
             "documents": {
-                "accessible": len(documents),
-                "total_pages": sum(doc.page_count for doc in documents),
-                "total_chunks": sum(doc.chunk_count for doc in documents),
-                "total_size_bytes": sum(doc.file_size for doc in documents)
+                "accessible": document_totals[0],
+                "total_pages": document_totals[1],
+                "total_chunks": document_totals[2],
+                "total_size_bytes": document_totals[3]
             },
             "queries": {
-                "total": len(queries),
-                "average_processing_time": sum(q.processing_time for q in queries) / len(queries) if queries else 0
+                "total": query_count,
+                "average_processing_time": avg_query_time
             },
             "performance": perf_stats,
             "cache": {
@@ -705,7 +772,7 @@ async def get_statistics(
             },
             "tasks": task_stats,
             "errors": error_stats,
-            "system": system_monitor.get_system_stats()
+            "system": await asyncio.to_thread(system_monitor.get_system_stats)
         }
         
     except Exception as e:
@@ -1,16 +1,24 @@
 # app/async_processing.py - Asynchronous processing for file uploads and heavy tasks
 
 import asyncio
+import logging
 import uuid
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List, Callable
 from enum import Enum
-import json
-from dataclasses import dataclass, asdict
+import orjson
+from dataclasses import dataclass
+from functools import lru_cache
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from app.database import get_db, Document
+from app.database import get_db, Document, SessionLocal, Task as TaskRecord
 from app.config import settings
+from app.file_processor import DocumentProcessor
+from app.embedding import extract_chunks, index_document_async
+from app.search import get_hybrid_searcher, query_expander
+
+logger = logging.getLogger(__name__)
 
 class TaskStatus(Enum):
     PENDING = "pending"
@@ -33,22 +41,68 @@ class Task:
     metadata: Dict[str, Any] = None
     
     def to_dict(self) -> Dict[str, Any]:
-        """Convert task to dictionary for JSON serialization"""
-        data = asdict(self)
-        data['status'] = self.status.value
-        data['created_at'] = self.created_at.isoformat()
-        data['started_at'] = self.started_at.isoformat() if self.started_at else None
-        data['completed_at'] = self.completed_at.isoformat() if self.completed_at else None
-        return data
+        """Convert task to dictionary for JSON serialization (datetimes are left to orjson)"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "completed_at": self.completed_at,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "metadata": self.metadata
+        }
+    
+    @classmethod
+    def from_record(cls, record: TaskRecord) -> "Task":
+        """Build a Task from its row in the tasks table"""
+        return cls(
+            id=record.id,
+            name=record.name,
+            status=TaskStatus(record.state),
+            created_at=record.created_at,
+            started_at=record.started_at,
+            completed_at=record.completed_at,
+            progress=record.progress or 0.0,
+            result=orjson.loads(record.result) if record.result else None,
+            error=record.error_message,
+            metadata=orjson.loads(record.task_metadata) if record.task_metadata else {}
+        )
 
 class TaskManager:
-    """Manages asynchronous tasks"""
+    """Manages asynchronous tasks.
     
-    def __init__(self):
+    create_task enqueues onto an asyncio.Queue drained by max_concurrent_tasks
+    long-lived worker coroutines, started lazily on the running loop.
+    Task state lives in the tasks table, so it is bounded by cleanup, survives
+    restarts and is visible to every worker process; self.tasks only holds
+    the tasks queued or running in this process. Rows are written from worker
+    threads and only on status changes: progress is kept in memory and served
+    from self.tasks while the task runs here.
+    """
+    
+    def __init__(self, max_concurrent_tasks: int = 5):
         self.tasks: Dict[str, Task] = {}
         self.running_tasks: Dict[str, asyncio.Task] = {}
-        self.max_concurrent_tasks = 5
+        self.max_concurrent_tasks = max_concurrent_tasks
         self.task_timeout = 3600  # 1 hour
+        self._pending: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._completions: Dict[str, asyncio.Future] = {}
+        self._inserts: Dict[str, asyncio.Task] = {}  # task id -> pending row insert
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _ensure_workers(self):
+        """Start the queue and workers on the current loop (again if the loop changed)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        
+        self._loop = loop
+        self._pending = asyncio.Queue()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.max_concurrent_tasks)]
         
     def create_task(self, name: str, func: Callable, *args, **kwargs) -> str:
         """Create a new asynchronous task"""
@@ -64,21 +118,83 @@ class TaskManager:
         
         self.tasks[task_id] = task
         
-        # Start task if we have capacity
-        if len(self.running_tasks) < self.max_concurrent_tasks:
-            self._start_task(task_id, func, *args, **kwargs)
+        self._ensure_workers()
+        self._inserts[task_id] = self._loop.create_task(asyncio.to_thread(self._insert, task))
+        self._completions[task_id] = self._loop.create_future()
+        self._pending.put_nowait((task_id, func, args, kwargs))
         
         return task_id
     
-    def _start_task(self, task_id: str, func: Callable, *args, **kwargs):
-        """Start executing a task"""
-        task = self.tasks[task_id]
-        task.status = TaskStatus.RUNNING
-        task.started_at = datetime.utcnow()
-        
-        # Create asyncio task
-        async_task = asyncio.create_task(self._execute_task(task_id, func, *args, **kwargs))
-        self.running_tasks[task_id] = async_task
+    def _insert(self, task: Task):
+        """Add a new task row"""
+        db = SessionLocal()
+        try:
+            db.add(TaskRecord(
+                id=task.id,
+                name=task.name,
+                state=task.status.value,
+                progress=task.progress,
+                created_at=task.created_at,
+                task_metadata=orjson.dumps(task.metadata, default=str).decode() if task.metadata else None
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Task store error: {e}")
+        finally:
+            db.close()
+    
+    def _persist(self, task: Task):
+        """Write the task's current state to its row (one UPDATE by primary key)"""
+        db = SessionLocal()
+        try:
+            db.query(TaskRecord).filter(TaskRecord.id == task.id).update({
+                TaskRecord.state: task.status.value,
+                TaskRecord.progress: task.progress,
+                TaskRecord.started_at: task.started_at,
+                TaskRecord.completed_at: task.completed_at,
+                TaskRecord.result: orjson.dumps(task.result, default=str).decode() if task.result is not None else None,
+                TaskRecord.error_message: task.error
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Task store error: {e}")
+        finally:
+            db.close()
+    
+    async def _worker(self):
+        """Run queued tasks one at a time"""
+        while True:
+            task_id, func, args, kwargs = await self._pending.get()
+            try:
+                # The row must exist before it is updated
+                await self._inserts.pop(task_id)
+                task = self.tasks.get(task_id)
+                if task and task.status != TaskStatus.PENDING:  # cancelled while queued
+                    await asyncio.to_thread(self._persist, task)
+                elif task:
+                    task.status = TaskStatus.RUNNING
+                    task.started_at = datetime.utcnow()
+                    await asyncio.to_thread(self._persist, task)
+                    
+                    # Own asyncio task so cancel_task can stop it without killing the worker
+                    runner = asyncio.create_task(self._execute_task(task_id, func, *args, **kwargs))
+                    self.running_tasks[task_id] = runner
+                    await asyncio.wait({runner})
+                    
+                    if runner.cancelled():  # cancelled before it got to run
+                        task.status = TaskStatus.CANCELLED
+                        task.completed_at = datetime.utcnow()
+                        task.error = "Task was cancelled"
+                    await asyncio.to_thread(self._persist, task)
+            finally:
+                self.running_tasks.pop(task_id, None)
+                self.tasks.pop(task_id, None)
+                completion = self._completions.pop(task_id, None)
+                if completion and not completion.done():
+                    completion.set_result(None)
+                self._pending.task_done()
     
     async def _execute_task(self, task_id: str, func: Callable, *args, **kwargs):
         """Execute a task with error handling"""
@@ -111,39 +227,63 @@ class TaskManager:
             task.status = TaskStatus.FAILED
             task.completed_at = datetime.utcnow()
             task.error = str(e)
-            
-        finally:
-            # Clean up
-            if task_id in self.running_tasks:
-                del self.running_tasks[task_id]
-            
-            # Start next pending task if any
-            self._start_next_pending_task()
     
     def _update_progress(self, task_id: str, progress: float):
-        """Update task progress"""
-        if task_id in self.tasks:
-            self.tasks[task_id].progress = min(100.0, max(0.0, progress))
+        """Update task progress (in memory; the row is written on the next status change)"""
+        task = self.tasks.get(task_id)
+        if task:
+            task.progress = min(100.0, max(0.0, progress))
     
-    def _start_next_pending_task(self):
-        """Start the next pending task if we have capacity"""
-        if len(self.running_tasks) >= self.max_concurrent_tasks:
-            return
-        
-        # Find next pending task
-        for task_id, task in self.tasks.items():
-            if task.status == TaskStatus.PENDING:
-                # We need to store the function and args with the task
-                # For now, we'll skip this complexity
-                break
+    async def wait_for_task(self, task_id: str, timeout: Optional[float] = None) -> Optional[Task]:
+        """Wait for a queued or running task to finish (or the timeout to expire) and return it"""
+        completion = self._completions.get(task_id)
+        if completion:
+            try:
+                await asyncio.wait_for(asyncio.shield(completion), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.get_task_async(task_id)
     
     def get_task(self, task_id: str) -> Optional[Task]:
         """Get task by ID"""
-        return self.tasks.get(task_id)
+        task = self.tasks.get(task_id)
+        if task:
+            return task
+        return self._load(task_id)
+    
+    async def get_task_async(self, task_id: str) -> Optional[Task]:
+        """get_task for use on the event loop; finished tasks are read from the store in a worker thread"""
+        task = self.tasks.get(task_id)
+        if task:
+            return task
+        return await asyncio.to_thread(self._load, task_id)
+    
+    def _load(self, task_id: str) -> Optional[Task]:
+        db = SessionLocal()
+        try:
+            record = db.query(TaskRecord).filter(TaskRecord.id == task_id).first()
+            return Task.from_record(record) if record else None
+        finally:
+            db.close()
     
     def get_all_tasks(self) -> List[Task]:
         """Get all tasks"""
-        return list(self.tasks.values())
+        db = SessionLocal()
+        try:
+            return [Task.from_record(record) for record in db.query(TaskRecord).all()]
+        finally:
+            db.close()
+    
+    def get_status_counts(self) -> Dict[str, int]:
+        """Number of tasks per status, counted in SQL"""
+        db = SessionLocal()
+        try:
+            counts = dict(
+                db.query(TaskRecord.state, func.count(TaskRecord.id)).group_by(TaskRecord.state).all()
+            )
+        finally:
+            db.close()
+        return {status.value: counts.get(status.value, 0) for status in TaskStatus}
     
     def cancel_task(self, task_id: str) -> bool:
         """Cancel a running task"""
@@ -152,26 +292,39 @@ class TaskManager:
             async_task.cancel()
             return True
         elif task_id in self.tasks and self.tasks[task_id].status == TaskStatus.PENDING:
-            self.tasks[task_id].status = TaskStatus.CANCELLED
-            self.tasks[task_id].completed_at = datetime.utcnow()
+            # Still queued: the worker skips it and writes the cancelled row
+            task = self.tasks[task_id]
+            task.status = TaskStatus.CANCELLED
+            task.completed_at = datetime.utcnow()
+            task.error = "Task was cancelled"
             return True
         return False
     
     def cleanup_old_tasks(self, max_age_hours: int = 24):
         """Clean up old completed tasks"""
         cutoff_time = datetime.utcnow() - timedelta(hours=max_age_hours)
+        finished = [TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value]
         
-        to_remove = []
-        for task_id, task in self.tasks.items():
-            if (task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED] and
-                task.completed_at and task.completed_at < cutoff_time):
-                to_remove.append(task_id)
-        
-        for task_id in to_remove:
-            del self.tasks[task_id]
+        db = SessionLocal()
+        try:
+            db.query(TaskRecord).filter(
+                TaskRecord.state.in_(finished),
+                TaskRecord.completed_at < cutoff_time
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Task cleanup error: {e}")
+        finally:
+            db.close()
+
+@lru_cache(maxsize=None)
+def get_task_manager() -> TaskManager:
+    """The process-wide TaskManager (also usable as Depends(get_task_manager))"""
+    return TaskManager()
 
 # Global task manager
-task_manager = TaskManager()
+task_manager = get_task_manager()
 
 class AsyncDocumentProcessor:
     """Asynchronous document processing"""
@@ -183,36 +336,35 @@ class AsyncDocumentProcessor:
             if progress_callback:
                 progress_callback(10)
             
-            # Import here to avoid circular imports
-            from app.file_processor import DocumentProcessor
-            from app.embedding import create_faiss_index
+            file_hash = await asyncio.to_thread(AsyncDocumentProcessor._document_hash, document_id)
             
             # Extract text and metadata
             if progress_callback:
                 progress_callback(30)
             
-            text, metadata = DocumentProcessor.extract_text_from_pdf(file_path)
+            # Parsing and embedding are CPU-bound; run them off the event loop.
+            # The upload already extracted this file, so this is normally a cache hit.
+            text, metadata = await asyncio.to_thread(
+                DocumentProcessor.extract_text_from_pdf, file_path, file_hash
+            )
             
             if progress_callback:
                 progress_callback(60)
             
-            # Create embeddings
-            chunk_count = create_faiss_index(file_path, document_id)
+            # Create embeddings from the extracted text instead of parsing the PDF again;
+            # scanned documents have no text to index. Documents from the same upload
+            # reach this point together and share one embedding batch.
+            if metadata.get("scanned_only"):
+                chunk_count = 0
+            else:
+                chunks = await asyncio.to_thread(extract_chunks, file_path, "word", text)
+                chunk_count = await index_document_async(file_path, document_id, chunks)
             
             if progress_callback:
                 progress_callback(90)
             
             # Update database
-            from app.database import SessionLocal
-            db = SessionLocal()
-            
-            document = db.query(Document).filter(Document.id == document_id).first()
-            if document:
-                document.chunk_count = chunk_count
-                document.file_metadata = json.dumps(metadata)
-                db.commit()
-            
-            db.close()
+            await asyncio.to_thread(AsyncDocumentProcessor._save_results, document_id, chunk_count, metadata)
             
             if progress_callback:
                 progress_callback(100)
@@ -225,6 +377,26 @@ class AsyncDocumentProcessor:
             
         except Exception as e:
             raise Exception(f"Document processing failed: {str(e)}")
+    
+    @staticmethod
+    def _document_hash(document_id: int) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            return db.query(Document.file_hash).filter(Document.id == document_id).scalar()
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _save_results(document_id: int, chunk_count: int, metadata: Dict[str, Any]):
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if document:
+                document.chunk_count = chunk_count
+                document.file_metadata = metadata
+                db.commit()
+        finally:
+            db.close()
 
 class AsyncQueryProcessor:
     """Asynchronous query processing for complex queries"""
@@ -236,34 +408,23 @@ class AsyncQueryProcessor:
             if progress_callback:
                 progress_callback(10)
             
-            # Import here to avoid circular imports
-            from app.search import hybrid_searcher, query_expander
-            from app.rag import get_answer_advanced
-            from app.database import SessionLocal, DocumentChunk
-            
             # Expand query if needed
             if progress_callback:
                 progress_callback(20)
             
             expanded_query = query_expander.expand_query(query)
             
-            # Get relevant chunks
             if progress_callback:
                 progress_callback(40)
             
-            db = SessionLocal()
-            chunks = db.query(DocumentChunk).filter(
-                DocumentChunk.document_id.in_(document_ids)
-            ).all()
-            
-            # Build search index
+            # Build search index (cached per document set until documents change)
             if progress_callback:
                 progress_callback(60)
             
-            hybrid_searcher.build_index(chunks)
+            searcher = await asyncio.to_thread(get_hybrid_searcher, document_ids)
             
             # Perform search
-            search_results = hybrid_searcher.search(expanded_query, top_k=10, strategy=search_type)
+            search_results = await asyncio.to_thread(searcher.search, expanded_query, 10, search_type)
             
             if progress_callback:
                 progress_callback(80)
@@ -272,8 +433,6 @@ class AsyncQueryProcessor:
             # answer = get_answer_advanced(query, search_results, chunks)
             answer = f"Advanced answer for: {query}"  # Placeholder
             
-            db.close()
-            
             if progress_callback:
                 progress_callback(100)
             
@@ -356,21 +515,25 @@ async def schedule_complex_query(query: str, document_ids: List[int], search_typ
     )
     return task_id
 
+def _clear_expired_cache(cache_manager):
+    db = SessionLocal()
+    try:
+        cache_manager.clear_expired_cache(db)
+    finally:
+        db.close()
+
 # Background task for cleanup
 async def background_cleanup_task():
     """Background task to cleanup old tasks and cache"""
     while True:
         try:
             # Cleanup old tasks
-            task_manager.cleanup_old_tasks()
+            await asyncio.to_thread(task_manager.cleanup_old_tasks)
             
             # Cleanup expired cache (if cache module is available)
             try:
                 from app.cache import cache_manager
-                from app.database import SessionLocal
-                db = SessionLocal()
-                cache_manager.clear_expired_cache(db)
-                db.close()
+                await asyncio.to_thread(_clear_expired_cache, cache_manager)
             except ImportError:
                 pass
             
@@ -378,16 +541,13 @@ async def background_cleanup_task():
             await asyncio.sleep(3600)
             
         except Exception as e:
-            print(f"Background cleanup error: {e}")
+            logger.error(f"Background cleanup error: {e}")
             await asyncio.sleep(60)  # Wait 1 minute on error
 
-# Global task manager instance
-task_manager = TaskManager()
-
 # API helper functions
 def submit_async_task(task_name: str, task_func: Callable, *args, **kwargs) -> str:
     """Submit an async task and return task ID"""
-    return task_manager.submit_task(task_name, task_func, *args, **kwargs)
+    return task_manager.create_task(task_name, task_func, *args, **kwargs)
 
 def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
     """Get status of a task"""
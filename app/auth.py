@@ -9,7 +9,7 @@ import jwt
 import hashlib
 import secrets
 import bcrypt
-from app.database import get_db, User, APIKey
+from app.database import get_db, SessionLocal, User, APIKey
 from app.config import settings
 
 # JWT Configuration
@@ -106,6 +106,19 @@ def authenticate_user(username: str, password: str, db: Session) -> Optional[Use
         return None
     return user
 
+def update_last_login(user_id: int, login_time: datetime):
+    """Record a user's last login outside the request (run as a background task)"""
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.id == user_id).update(
+            {User.last_login: login_time}, synchronize_session=False
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+    finally:
+        db.close()
+
 async def get_current_user_or_api_key(
     request: Request,
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
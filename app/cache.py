@@ -1,20 +1,52 @@
 # app/cache.py - Caching system for RAG pipeline
 
 import hashlib
-import json
+import orjson
 import time
+import threading
+import numpy as np
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from sqlalchemy.orm import Session
-from app.database import get_db, QueryCache
+from app.database import get_db, QueryCache, Document
 from app.config import settings
 
 class CacheManager:
     """Manages query caching with database persistence"""
     
-    def __init__(self):
+    def __init__(self, hot_size: int = 1024):
         self.cache_ttl = settings.cache_ttl
         self.enabled = settings.enable_caching
+        # In-process LRU in front of the query_cache table: query_hash -> (response, expires_at)
+        self._hot: "OrderedDict[str, Tuple[str, datetime]]" = OrderedDict()
+        self._hot_size = hot_size
+        self._hot_lock = threading.Lock()
+        self.hot_hits = 0
+    
+    def _hot_get(self, query_hash: str) -> Optional[str]:
+        with self._hot_lock:
+            entry = self._hot.get(query_hash)
+            if entry is None:
+                return None
+            if entry[1] <= datetime.utcnow():
+                del self._hot[query_hash]
+                return None
+            self._hot.move_to_end(query_hash)
+            self.hot_hits += 1
+            return entry[0]
+    
+    def _hot_put(self, query_hash: str, response: str, expires_at: datetime):
+        with self._hot_lock:
+            self._hot[query_hash] = (response, expires_at)
+            self._hot.move_to_end(query_hash)
+            while len(self._hot) > self._hot_size:
+                self._hot.popitem(last=False)
+    
+    def clear_hot(self):
+        """Drop the in-process layer (the query_cache table is untouched)"""
+        with self._hot_lock:
+            self._hot.clear()
     
     def _generate_query_hash(self, query: str, document_ids: List[int], k: int = 3) -> str:
         """Generate hash for query + document combination"""
@@ -23,11 +55,11 @@ class CacheManager:
             "documents": sorted(document_ids),
             "k": k
         }
-        return hashlib.sha256(json.dumps(cache_key, sort_keys=True).encode()).hexdigest()
+        return hashlib.sha256(orjson.dumps(cache_key, option=orjson.OPT_SORT_KEYS)).hexdigest()
     
     def _generate_documents_hash(self, document_ids: List[int]) -> str:
         """Generate hash for document set"""
-        return hashlib.sha256(json.dumps(sorted(document_ids)).encode()).hexdigest()
+        return hashlib.sha256(orjson.dumps(sorted(document_ids))).hexdigest()
     
     def get_cached_response(self, query: str, document_ids: List[int], k: int = 3, db: Session = None) -> Optional[str]:
         """Get cached response if available and valid"""
@@ -37,6 +69,11 @@ class CacheManager:
         try:
             query_hash = self._generate_query_hash(query, document_ids, k)
             
+            # Hot queries are answered without touching the database
+            response = self._hot_get(query_hash)
+            if response is not None:
+                return response
+            
             cache_entry = db.query(QueryCache).filter(
                 QueryCache.query_hash == query_hash,
                 QueryCache.expires_at > datetime.utcnow()
@@ -46,6 +83,7 @@ class CacheManager:
                 # Update hit count
                 cache_entry.hit_count += 1
                 db.commit()
+                self._hot_put(query_hash, cache_entry.response_text, cache_entry.expires_at)
                 return cache_entry.response_text
             
             return None
@@ -80,6 +118,7 @@ class CacheManager:
             
             db.add(cache_entry)
             db.commit()
+            self._hot_put(query_hash, response, expires_at)
             
         except Exception as e:
             print(f"Cache storage error: {e}")
@@ -92,6 +131,7 @@ class CacheManager:
         
         try:
             documents_hash = self._generate_documents_hash(document_ids)
+            self.clear_hot()
             
             # Delete cache entries that used these documents
             db.query(QueryCache).filter(QueryCache.documents_hash == documents_hash).delete()
@@ -130,6 +170,8 @@ class CacheManager:
                 "active_entries": total_entries - expired_entries,
                 "expired_entries": expired_entries,
                 "total_hits": total_hits,
+                "hot_entries": len(self._hot),
+                "hot_hits": self.hot_hits,
                 "cache_enabled": self.enabled
             }
             
@@ -186,9 +228,164 @@ class InMemoryCache:
             "ttl": self.ttl
         }
 
+class SemanticQueryCache:
+    """
+    Answer cache keyed by query embedding, so paraphrases of an answered
+    question skip retrieval and the LLM call.
+
+    Candidates come from random-projection LSH tables (sign of emb @ R) and
+    are verified with exact cosine similarity against the threshold. Entries
+    are scoped (document set + k), evicted LRU and expire after ttl seconds.
+    """
+    
+    def __init__(self, threshold: float = 0.95, max_size: int = 1000, ttl: int = 3600,
+                 nbits: int = 16, num_tables: int = 4, seed: int = 0):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.nbits = nbits
+        self.num_tables = num_tables
+        self.seed = seed
+        self.planes = None  # (num_tables, dimension, nbits), built on first use
+        self.tables = [{} for _ in range(num_tables)]  # bucket -> set of entry ids
+        self.entries = OrderedDict()  # entry id -> (embedding, answer, query_id, scope, created_at, buckets)
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def scope_key(document_ids: List[int], k: int) -> str:
+        """Answers are only reusable for the same searchable documents and k"""
+        return f"{k}:{','.join(map(str, sorted(document_ids)))}"
+    
+    def _buckets(self, embedding: np.ndarray) -> List[int]:
+        if self.planes is None:
+            rng = np.random.default_rng(self.seed)
+            self.planes = rng.standard_normal(
+                (self.num_tables, embedding.shape[0], self.nbits)
+            ).astype(np.float32)
+        bits = np.einsum("d,tdn->tn", embedding, self.planes) > 0
+        return (bits @ (1 << np.arange(self.nbits))).tolist()
+    
+    def _evict_locked(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        for table, bucket in zip(self.tables, entry[5]):
+            members = table.get(bucket)
+            if members:
+                members.discard(entry_id)
+                if not members:
+                    del table[bucket]
+    
+    def get(self, embedding: np.ndarray, scope: str) -> Optional[Tuple[str, Optional[int]]]:
+        """Return (answer, query_id) of the closest cached query above the threshold"""
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        now = time.time()
+        
+        with self.lock:
+            candidates = set()
+            for table, bucket in zip(self.tables, self._buckets(embedding)):
+                candidates |= table.get(bucket, set())
+            
+            best_id, best_score = None, self.threshold
+            for entry_id in candidates:
+                cached_embedding, _, _, entry_scope, created_at, _ = self.entries[entry_id]
+                if now - created_at >= self.ttl:
+                    self._evict_locked(entry_id)
+                    continue
+                if entry_scope != scope:
+                    continue
+                score = float(np.dot(cached_embedding, embedding))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            
+            if best_id is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self.entries.move_to_end(best_id)
+            entry = self.entries[best_id]
+            return entry[1], entry[2]
+    
+    def put(self, embedding: np.ndarray, answer: str, query_id: Optional[int], scope: str):
+        """Cache an answer for an L2-normalized query embedding"""
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        
+        with self.lock:
+            while len(self.entries) >= self.max_size:
+                self._evict_locked(next(iter(self.entries)))
+            
+            entry_id = self.next_id
+            self.next_id += 1
+            buckets = self._buckets(embedding)
+            self.entries[entry_id] = (embedding, answer, query_id, scope, time.time(), buckets)
+            for table, bucket in zip(self.tables, buckets):
+                table.setdefault(bucket, set()).add(entry_id)
+    
+    def clear(self):
+        """Drop all entries (e.g. after the document set changes)"""
+        with self.lock:
+            self.entries.clear()
+            self.tables = [{} for _ in range(self.num_tables)]
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        return {
+            "total_items": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "threshold": self.threshold,
+            "max_size": self.max_size,
+            "ttl": self.ttl
+        }
+
+class DocumentListCache:
+    """
+    (id, file_path, owner_id, is_public) of every document, so the query path
+    doesn't scan and hydrate the documents table per request. Invalidated on
+    upload/delete; the TTL bounds staleness for other worker processes.
+    """
+    
+    def __init__(self, ttl: int = 60):
+        self.ttl = ttl
+        self._rows = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _load(self, db: Session) -> List[Tuple[int, str, Optional[int], bool]]:
+        with self._lock:
+            if self._rows is None or time.time() - self._loaded_at >= self.ttl:
+                self._rows = [
+                    tuple(row) for row in db.query(
+                        Document.id, Document.file_path, Document.owner_id, Document.is_public
+                    ).order_by(Document.id).all()
+                ]
+                self._loaded_at = time.time()
+            return self._rows
+    
+    def get_accessible(self, db: Session, user_id: Optional[int] = None,
+                       all_documents: bool = False) -> Tuple[List[int], List[str]]:
+        """Return (document_ids, file_paths) of public documents plus those owned by user_id"""
+        rows = self._load(db)
+        if not all_documents:
+            rows = [row for row in rows if row[3] or (user_id is not None and row[2] == user_id)]
+        return [row[0] for row in rows], [row[1] for row in rows]
+    
+    def invalidate(self):
+        """Force a reload on next access"""
+        with self._lock:
+            self._rows = None
+
 # Global in-memory cache instances (after class definition)
 embedding_cache = InMemoryCache(max_size=500, ttl=1800)  # 30 minutes
 document_cache = InMemoryCache(max_size=100, ttl=600)    # 10 minutes
+document_list_cache = DocumentListCache()
+semantic_query_cache = SemanticQueryCache(
+    threshold=settings.semantic_cache_threshold,
+    max_size=settings.semantic_cache_size,
+    ttl=settings.cache_ttl
+)
 
 # Global cache manager instance
 cache_manager = CacheManager()
@@ -199,7 +396,8 @@ def query_cache(query: str, document_ids: List[int], k: int = 3) -> Optional[Dic
     from app.database import SessionLocal
     db = SessionLocal()
     try:
-        return cache_manager.get_query_result(query, document_ids, k, db)
+        answer = cache_manager.get_cached_response(query, document_ids, k, db)
+        return {"answer": answer, "cached": True} if answer is not None else None
     finally:
         db.close()
 
@@ -216,3 +414,4 @@ def clear_all_cache():
     """Clear all caches"""
     embedding_cache.clear()
     document_cache.clear()
+    cache_manager.clear_hot()
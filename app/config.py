@@ -1,14 +1,39 @@
 # app/config.py - Configuration management
 
 import os
-from typing import Optional
+from functools import lru_cache
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
-from pydantic import ConfigDict
+from pydantic import ConfigDict, model_validator
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Per-environment defaults; explicitly set values (init kwargs, env vars, .env) win
+ENVIRONMENT_OVERRIDES = {
+    "development": {
+        "debug": True,
+        "log_level": "DEBUG",
+        "enable_performance_logging": True,
+    },
+    "production": {
+        "debug": False,
+        "log_level": "WARNING",
+        "enable_caching": True,
+        "enable_async_processing": True,
+    },
+    "testing": {
+        "database_url": "sqlite:///./test_rag_database.db",
+        "debug": True,
+        "log_level": "DEBUG",
+        "max_files_per_request": 5,  # Lower for testing
+    },
+}
 
 class Settings(BaseSettings):
     # API Configuration
     app_name: str = "RAG Pipeline API"
     app_version: str = "2.0.0"
+    environment: Optional[str] = None  # development, production or testing
     debug: bool = False
     
     # Database Configuration
@@ -40,6 +65,9 @@ class Settings(BaseSettings):
     
     # RAG Configuration
     embedding_model: str = "all-MiniLM-L6-v2"
+    # "onnx"/"openvino" need sentence-transformers>=3.2 with optimum installed; falls back to torch otherwise
+    embedding_backend: Literal["torch", "onnx", "openvino"] = "torch"
+    embedding_model_file: Optional[str] = None  # e.g. "onnx/model_qint8_avx512.onnx" for int8 ONNX weights
     chunk_size: int = 800
     chunk_overlap: int = 100
     chunking_strategy: str = "word"  # word, sentence, paragraph
@@ -47,6 +75,10 @@ class Settings(BaseSettings):
     max_search_results: int = 5
     max_chunk_size: int = 1000
     overlap_size: int = 200
+    faiss_index_type: Literal["flat", "ivf_flat", "ivf_sq8", "ivf_pq"] = "ivf_sq8"  # corpus index once large enough to train
+    faiss_threads: Optional[int] = None  # OpenMP threads for FAISS index builds (add/train); None = all cores
+    faiss_search_threads: int = 1  # OpenMP threads per single-query FAISS search
+    embedding_processes: Optional[int] = None  # CPU encode worker processes for large batches; None = all cores, 1 = off
     
     # Rate Limiting
     rate_limit_uploads: str = "10/minute"
@@ -60,7 +92,11 @@ class Settings(BaseSettings):
     # Performance
     enable_caching: bool = True
     cache_ttl: int = 3600  # 1 hour
+    enable_semantic_cache: bool = False  # reuse answers for near-duplicate queries
+    semantic_cache_threshold: float = 0.95  # minimum cosine similarity for a hit
+    semantic_cache_size: int = 1000
     enable_async_processing: bool = True
+    sync_upload_timeout: int = 300  # seconds an upload with ?sync=true waits for indexing
     
     # Logging
     log_level: str = "INFO"
@@ -73,60 +109,43 @@ class Settings(BaseSettings):
     redoc_url: str = "/redoc"
     
     model_config = ConfigDict(env_file=".env", env_prefix="RAG_")
+    
+    @model_validator(mode="after")
+    def apply_environment_overrides(self):
+        for name, value in ENVIRONMENT_OVERRIDES.get((self.environment or "").lower(), {}).items():
+            if name not in self.model_fields_set:
+                setattr(self, name, value)
+        return self
 
 # Global settings instance
 settings = Settings()
 
+@lru_cache(maxsize=1)
 def get_database_url() -> str:
     """Get database URL with absolute path for SQLite"""
     if settings.database_url.startswith("sqlite:///"):
         # Convert to absolute path
         db_path = settings.database_url.replace("sqlite:///", "")
         if not os.path.isabs(db_path):
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            db_path = os.path.join(project_root, db_path)
+            db_path = os.path.join(PROJECT_ROOT, db_path)
         return f"sqlite:///{db_path}"
     return settings.database_url
 
+@lru_cache(maxsize=1)
 def get_upload_directory() -> str:
     """Get absolute path for upload directory"""
     if not os.path.isabs(settings.upload_directory):
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        return os.path.join(project_root, settings.upload_directory)
+        return os.path.join(PROJECT_ROOT, settings.upload_directory)
     return settings.upload_directory
 
+@lru_cache(maxsize=1)
 def get_index_directory() -> str:
     """Get absolute path for index directory"""
     if not os.path.isabs(settings.index_directory):
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        return os.path.join(project_root, settings.index_directory)
+        return os.path.join(PROJECT_ROOT, settings.index_directory)
     return settings.index_directory
 
-# Environment-specific configurations
-class DevelopmentConfig(Settings):
-    debug: bool = True
-    log_level: str = "DEBUG"
-    enable_performance_logging: bool = True
-
-class ProductionConfig(Settings):
-    debug: bool = False
-    log_level: str = "WARNING"
-    enable_caching: bool = True
-    enable_async_processing: bool = True
-
-class TestingConfig(Settings):
-    database_url: str = "sqlite:///./test_rag_database.db"
-    debug: bool = True
-    log_level: str = "DEBUG"
-    max_files_per_request: int = 5  # Lower for testing
-
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
-    """Get settings based on environment"""
-    env = os.getenv("RAG_ENVIRONMENT", "development").lower()
-    
-    if env == "production":
-        return ProductionConfig()
-    elif env == "testing":
-        return TestingConfig()
-    else:
-        return DevelopmentConfig()
+    """Get settings based on environment (built once; usable as Depends(get_settings))"""
+    return Settings(environment=os.getenv("RAG_ENVIRONMENT", "development").lower())
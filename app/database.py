@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean, ForeignKey, JSON, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import bindparam, create_engine, event, func
 from datetime import datetime
+import numpy as np
+import orjson
 import os
 
 Base = declarative_base()
@@ -49,9 +52,9 @@ class Document(Base):
     file_size = Column(Integer)
     page_count = Column(Integer)
     chunk_count = Column(Integer)
-    upload_date = Column(DateTime, default=datetime.utcnow)
+    upload_date = Column(DateTime, default=datetime.utcnow, index=True)
     file_hash = Column(String, index=True)
-    file_metadata = Column(Text)  # JSON string for additional metadata
+    file_metadata = Column(JSON)  # additional metadata (TEXT holding JSON on SQLite)
     owner_id = Column(Integer, ForeignKey("users.id"))
     is_public = Column(Boolean, default=False)
     
@@ -66,7 +69,7 @@ class DocumentChunk(Base):
     document_id = Column(Integer, ForeignKey("documents.id"))
     chunk_index = Column(Integer)
     content = Column(Text)
-    embedding_vector = Column(Text)  # Serialized vector
+    embedding_vector = Column(LargeBinary)  # float16 bytes, see pack_embedding/unpack_embedding
     page_number = Column(Integer)
     word_count = Column(Integer)
     chunk_type = Column(String, default="text")  # text, table, image_caption
@@ -74,6 +77,24 @@ class DocumentChunk(Base):
     # Relationships
     document = relationship("Document", back_populates="chunks")
     
+    @classmethod
+    def bulk_create(cls, session, rows: list):
+        """
+        Insert chunk rows (dicts of column values) as one executemany INSERT,
+        bypassing the ORM unit of work. Chunk persistence should go through
+        this rather than session.add per chunk. The caller commits.
+        """
+        if rows:
+            session.execute(cls.__table__.insert(), rows)
+
+def pack_embedding(vector) -> bytes:
+    """Raw float16 bytes for DocumentChunk.embedding_vector (768 B for 384 dims)"""
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+def unpack_embedding(data: bytes) -> np.ndarray:
+    """float32 vector from DocumentChunk.embedding_vector bytes"""
+    return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+    
 class Query(Base):
     __tablename__ = "queries"
     
@@ -131,6 +152,26 @@ class Task(Base):
     # Relationships
     user = relationship("User")
 
+# Metadata fields exposed in document listings, with their defaults
+DOCUMENT_LISTING_METADATA = {
+    "title": "",
+    "author": "",
+    "creation_date": "",
+    "extractable_pages": 0,
+    "total_text_length": 0
+}
+
+def document_metadata_columns():
+    """Listing metadata extracted in SQL with json_extract instead of parsing file_metadata per row"""
+    return [
+        func.coalesce(func.json_extract(Document.file_metadata, f"$.{key}"), default).label(key)
+        for key, default in DOCUMENT_LISTING_METADATA.items()
+    ]
+
+def document_hash_prefix_column(length: int = 16):
+    """Truncated file hash for listings, computed in SQL"""
+    return func.substr(Document.file_hash, 1, length).label("hash_prefix")
+
 # Database setup
 def get_database_url():
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -138,8 +179,67 @@ def get_database_url():
     return f"sqlite:///{db_path}"
 
 DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+# Applied to every SQLite connection: WAL lets readers run alongside the writer,
+# synchronous=NORMAL fsyncs per checkpoint instead of per commit, busy_timeout
+# waits out a concurrent writer instead of failing with "database is locked"
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "busy_timeout=5000",
+    "cache_size=-20000",  # 20MB page cache
+    "temp_store=MEMORY",
+    "foreign_keys=ON",
+)
+
+def _json_serializer(value) -> str:
+    return orjson.dumps(value).decode()
+
+# JSON columns are encoded/decoded with orjson
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False},
+                       json_serializer=_json_serializer, json_deserializer=orjson.loads)
+
+# Separate pool for read-only handlers so they never queue behind writers' connections
+read_engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False},
+                            json_serializer=_json_serializer, json_deserializer=orjson.loads,
+                            pool_size=os.cpu_count() or 1)
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself so SAVEPOINT (begin_nested) works with pysqlite
+    dbapi_connection.isolation_level = None
+    _apply_sqlite_pragmas(dbapi_connection, connection_record)
+
+def _configure_sqlite_reader(dbapi_connection, connection_record):
+    _configure_sqlite(dbapi_connection, connection_record)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def _begin_sqlite(conn):
+    conn.exec_driver_sql("BEGIN")
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionWriter = SessionLocal
+SessionReader = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Same database through aiosqlite, for handlers that shouldn't block the event loop
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, json_serializer=_json_serializer,
+                                   json_deserializer=orjson.loads)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+if DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", _configure_sqlite)
+    event.listen(engine, "begin", _begin_sqlite)
+    event.listen(read_engine, "connect", _configure_sqlite_reader)
+    event.listen(read_engine, "begin", _begin_sqlite)
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
 
 def get_db():
     """Get database session"""
@@ -149,15 +249,61 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """Get a read-only database session (separate connection pool)"""
+    db = SessionReader()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    """Get async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_tables():
     """Create database tables"""
     Base.metadata.create_all(bind=engine)
 
+def migrate_database():
+    """
+    Upgrade a database created by an earlier version in place (idempotent).
+    create_all only creates missing tables, so indexes added to existing tables
+    are created here, and embedding_vector values still holding serialized JSON
+    text are repacked as float16 bytes. file_metadata needs nothing: the JSON
+    column reads the JSON text the old TEXT column held.
+    """
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        
+        if not DATABASE_URL.startswith("sqlite"):
+            return
+        legacy_vectors = conn.exec_driver_sql(
+            "SELECT id, embedding_vector FROM document_chunks WHERE typeof(embedding_vector) = 'text'"
+        ).all()
+        if legacy_vectors:
+            rows = []
+            for chunk_id, serialized in legacy_vectors:
+                try:
+                    vector = pack_embedding(orjson.loads(serialized))
+                except (ValueError, TypeError):
+                    vector = None  # unreadable, leave it empty
+                rows.append({"chunk_id": chunk_id, "vector": vector})
+            table = DocumentChunk.__table__
+            conn.execute(
+                table.update().where(table.c.id == bindparam("chunk_id")).values(embedding_vector=bindparam("vector")),
+                rows
+            )
+
 def init_db():
     """Initialize the database with tables"""
     print("🔄 Initializing database...")
     try:
         create_tables()
+        migrate_database()
         print("✅ Database initialized successfully!")
         return True
     except Exception as e:
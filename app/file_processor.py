@@ -1,92 +1,344 @@
 import PyPDF2
 import os
-import json
+import mmap
+import orjson
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import Dict, Any, Tuple, List
-from app.security import MAX_PAGES_PER_DOCUMENT
+from functools import lru_cache, wraps
+from typing import Dict, Any, Tuple, List, Optional
+from app.security import MAX_PAGES_PER_DOCUMENT, SecurityValidator
+
+# PDFium (C++) extracts text several times faster than pure-Python PyPDF2;
+# PyPDF2 is still used for document metadata and as the fallback
+try:
+    import pypdfium2
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
+# PDFium is not thread-safe; upload handlers extract from several threads at once.
+# Held per PDFium call (open, one page, close), not per document, so concurrent
+# uploads interleave page by page instead of queueing behind a whole document.
+_pdfium_lock = threading.Lock()
+
+# Below this many (estimated) characters of text per MB of PDF, treat the
+# document as scanned images and skip full text extraction
+SCAN_TEXT_RATIO_THRESHOLD = 50
+
+# Extracted (text, metadata) as JSON under the file's SHA256; plain data, so a
+# tampered cache file can't run code the way a pickle could. Least recently
+# used entries are evicted past EXTRACT_CACHE_MAX_BYTES.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTRACT_CACHE_DIR = os.path.join(PROJECT_ROOT, "extract_cache")
+EXTRACT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+
+# PDFs with at least this many pages have their pages extracted in parallel,
+# one contiguous page range per worker process
+PARALLEL_EXTRACT_MIN_PAGES = 32
+PDF_EXTRACT_WORKERS = os.cpu_count() or 1
+
+# Stop collecting page text past this many characters; the rest of such a
+# document adds nothing retrieval can use
+MAX_EXTRACTED_TEXT_CHARS = 10 * 1024 * 1024
+
+def _map_pdf(file_path: str) -> mmap.mmap:
+    """
+    Read-only mmap of file_path for PyPDF2.PdfReader. The reader seeks all over
+    the file for xref tables and objects; through the mapping those are page-cache
+    hits rather than an 8KB buffered read syscall per seek.
+    """
+    with open(file_path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+@lru_cache(maxsize=1)
+def _get_extract_pool() -> ProcessPoolExecutor:
+    # spawn, not fork: the parent holds torch/FAISS thread pools that don't survive fork
+    return ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def _extract_page(page) -> Tuple[str, Optional[str]]:
+    """(text, error message or None) for one page"""
+    try:
+        return page.extract_text() or "", None
+    except Exception as e:
+        return "", str(e)
+
+def _extract_pdfium_page(pdf, page_num: int) -> Tuple[str, Optional[str]]:
+    try:
+        with _pdfium_lock:
+            page = pdf[page_num]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    return textpage.get_text_range(), None
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+    except Exception as e:
+        return "", str(e)
+
+def _extract_page_numbers(file_path: str, page_nums) -> List[Tuple[str, Optional[str]]]:
+    """(text, error) for the given pages with readers of its own (also run in worker processes)"""
+    page_nums = list(page_nums)
+    results = None
+    if PDFIUM_AVAILABLE:
+        try:
+            with _pdfium_lock:
+                pdf = pypdfium2.PdfDocument(file_path)
+            try:
+                results = [_extract_pdfium_page(pdf, page_num) for page_num in page_nums]
+            finally:
+                with _pdfium_lock:
+                    pdf.close()
+        except Exception:
+            results = None  # PDFium couldn't open it; let PyPDF2 try
+        if results is not None and all(error is None for _, error in results):
+            return results
+    
+    # PyPDF2 for everything without PDFium, and for the pages PDFium failed on
+    with _map_pdf(file_path) as mapped:
+        pages = PyPDF2.PdfReader(mapped).pages
+        if results is None:
+            return [_extract_page(pages[page_num]) for page_num in page_nums]
+        return [
+            result if result[1] is None else _extract_page(pages[page_num])
+            for page_num, result in zip(page_nums, results)
+        ]
+
+def _extract_pages(pdf_reader: PyPDF2.PdfReader, file_path: str,
+                   page_count: Optional[int] = None) -> List[Tuple[str, Optional[str]]]:
+    """(text, error) per page, split across the extract pool for long documents"""
+    pages = pdf_reader.pages
+    if page_count is None:
+        page_count = len(pages)
+    if page_count < PARALLEL_EXTRACT_MIN_PAGES or PDF_EXTRACT_WORKERS < 2:
+        return _extract_pages_in_process(pages, file_path, page_count)
+    
+    step = -(-page_count // PDF_EXTRACT_WORKERS)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    pool = _get_extract_pool()
+    try:
+        futures = [pool.submit(_extract_page_numbers, file_path, range(start, stop)) for start, stop in ranges]
+        return [result for future in futures for result in future.result()]
+    except BrokenProcessPool:
+        # A crashed worker breaks the pool for good: drop it so the next long
+        # document starts a fresh one, and extract this one here
+        _get_extract_pool.cache_clear()
+        pool.shutdown(wait=False)
+        return _extract_pages_in_process(pages, file_path, page_count)
+
+def _extract_pages_in_process(pages, file_path: str, page_count: int) -> List[Tuple[str, Optional[str]]]:
+    if PDFIUM_AVAILABLE:
+        return _extract_page_numbers(file_path, range(page_count))
+    return [_extract_page(pages[page_num]) for page_num in range(page_count)]
+
+def cached_by_file_hash(extract):
+    """Memoize a PDF extractor on disk, keyed by file_hash (computed if not given)"""
+    @wraps(extract)
+    def wrapper(file_path: str, file_hash: Optional[str] = None):
+        if file_hash is None:
+            with open(file_path, "rb") as file:
+                file_hash = SecurityValidator.calculate_file_hash(file)
+        
+        cache_path = _extract_cache_path(file_hash)
+        try:
+            with open(cache_path, "rb") as f:
+                text, metadata = orjson.loads(f.read())
+            os.utime(cache_path)  # mtime is the LRU clock
+            return text, metadata
+        except (OSError, ValueError):
+            pass
+        
+        result = extract(file_path)
+        
+        # Write-then-rename so concurrent readers never see a partial file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(result))
+        os.replace(tmp_path, cache_path)
+        _trim_extract_cache()
+        return result
+    return wrapper
+
+def _extract_cache_path(file_hash: str) -> str:
+    return os.path.join(EXTRACT_CACHE_DIR, f"{file_hash}.json")
+
+def _trim_extract_cache():
+    """Delete least recently used entries until the cache fits EXTRACT_CACHE_MAX_BYTES"""
+    entries = []
+    for entry in os.scandir(EXTRACT_CACHE_DIR):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue  # removed by a concurrent trim
+        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= EXTRACT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+def evict_extract_cache(file_hash: Optional[str]):
+    """Drop a file's cached extraction (e.g. when its document is deleted)"""
+    if file_hash:
+        try:
+            os.remove(_extract_cache_path(file_hash))
+        except FileNotFoundError:
+            pass
 
 class DocumentProcessor:
     @staticmethod
-    def extract_pdf_metadata(file_path: str) -> Dict[str, Any]:
-        """Extract comprehensive metadata from PDF"""
+    def extract_pdf_metadata(file_path: str, pdf_reader: Optional[PyPDF2.PdfReader] = None,
+                             file_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Extract comprehensive metadata from PDF. Callers that already hold an open
+        pdf_reader (and the file's size) pass them in so the file isn't reparsed.
+        """
         metadata = {
-            "file_size": os.path.getsize(file_path),
+            "file_size": os.path.getsize(file_path) if file_size is None else file_size,
             "processed_date": datetime.utcnow().isoformat(),
             "file_type": "PDF"
         }
         
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                # Basic PDF info
-                metadata["page_count"] = len(pdf_reader.pages)
-                metadata["is_encrypted"] = pdf_reader.is_encrypted
-                
-                # PDF metadata if available
-                if pdf_reader.metadata:
-                    pdf_metadata = pdf_reader.metadata
-                    metadata.update({
-                        "title": str(pdf_metadata.get('/Title', '')),
-                        "author": str(pdf_metadata.get('/Author', '')),
-                        "subject": str(pdf_metadata.get('/Subject', '')),
-                        "creator": str(pdf_metadata.get('/Creator', '')),
-                        "producer": str(pdf_metadata.get('/Producer', '')),
-                        "creation_date": str(pdf_metadata.get('/CreationDate', '')),
-                        "modification_date": str(pdf_metadata.get('/ModDate', ''))
-                    })
-                
-                # Validate page count
-                if metadata["page_count"] > MAX_PAGES_PER_DOCUMENT:
-                    raise ValueError(f"Document has {metadata['page_count']} pages, maximum allowed is {MAX_PAGES_PER_DOCUMENT}")
-                
+            if pdf_reader is None:
+                with _map_pdf(file_path) as mapped:
+                    DocumentProcessor._read_pdf_metadata(PyPDF2.PdfReader(mapped), metadata)
+            else:
+                DocumentProcessor._read_pdf_metadata(pdf_reader, metadata)
         except Exception as e:
             metadata["extraction_error"] = str(e)
             
         return metadata
     
     @staticmethod
+    def _read_pdf_metadata(pdf_reader: PyPDF2.PdfReader, metadata: Dict[str, Any]) -> None:
+        # Basic PDF info
+        metadata["page_count"] = page_count = len(pdf_reader.pages)
+        metadata["is_encrypted"] = pdf_reader.is_encrypted
+        
+        # PDF metadata if available
+        if pdf_reader.metadata:
+            pdf_metadata = pdf_reader.metadata
+            metadata.update({
+                "title": str(pdf_metadata.get('/Title', '')),
+                "author": str(pdf_metadata.get('/Author', '')),
+                "subject": str(pdf_metadata.get('/Subject', '')),
+                "creator": str(pdf_metadata.get('/Creator', '')),
+                "producer": str(pdf_metadata.get('/Producer', '')),
+                "creation_date": str(pdf_metadata.get('/CreationDate', '')),
+                "modification_date": str(pdf_metadata.get('/ModDate', ''))
+            })
+        
+        # Validate page count
+        if page_count > MAX_PAGES_PER_DOCUMENT:
+            raise ValueError(f"Document has {page_count} pages, maximum allowed is {MAX_PAGES_PER_DOCUMENT}")
+    
+    @staticmethod
+    @cached_by_file_hash
     def extract_text_from_pdf(file_path: str) -> Tuple[str, Dict[str, Any]]:
-        """Extract text and metadata from PDF with enhanced error handling"""
+        """Extract text and metadata from PDF with enhanced error handling (cached by file hash)"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
+            with _map_pdf(file_path) as mapped:
+                pdf_reader = PyPDF2.PdfReader(mapped)
+                file_size = len(mapped)
+                page_count = len(pdf_reader.pages)
                 
                 # Check page limit before processing
-                if len(pdf_reader.pages) > MAX_PAGES_PER_DOCUMENT:
+                if page_count > MAX_PAGES_PER_DOCUMENT:
                     raise ValueError(f"Document exceeds maximum page limit of {MAX_PAGES_PER_DOCUMENT} pages")
                 
-                text = ""
+                # Scanned documents yield next to no text but are expensive to parse
+                scanned = DocumentProcessor._detect_scanned_only(pdf_reader, file_path, file_size, page_count)
+                if scanned:
+                    metadata = DocumentProcessor.extract_pdf_metadata(file_path, pdf_reader, file_size)
+                    metadata.update(scanned)
+                    return "", metadata
+                
+                text_parts = []
                 page_texts = []
+                text_chars = 0
                 
-                for page_num, page in enumerate(pdf_reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        text += page_text + "\n"
+                for page_num, (page_text, error) in enumerate(_extract_pages(pdf_reader, file_path, page_count)):
+                    if text_chars >= MAX_EXTRACTED_TEXT_CHARS:
+                        break
+                    if error is None:
+                        text_chars += len(page_text)
+                        text_parts.append(page_text)
                         page_texts.append({
                             "page": page_num + 1,
                             "text_length": len(page_text),
                             "has_text": len(page_text.strip()) > 0
                         })
-                    except Exception as e:
+                    else:
                         page_texts.append({
                             "page": page_num + 1,
-                            "error": str(e),
+                            "error": error,
                             "text_length": 0,
                             "has_text": False
                         })
+                # One join, no per-page "text\n" temporaries
+                text = "\n".join(text_parts)
                 
                 # Extract metadata
-                metadata = DocumentProcessor.extract_pdf_metadata(file_path)
+                metadata = DocumentProcessor.extract_pdf_metadata(file_path, pdf_reader, file_size)
                 metadata["page_details"] = page_texts
-                metadata["total_text_length"] = len(text)
+                metadata["total_text_length"] = sum(map(len, text_parts)) + len(text_parts)  # each page + "\n"
                 metadata["extractable_pages"] = sum(1 for p in page_texts if p.get("has_text", False))
+                if len(page_texts) < page_count:
+                    metadata["text_truncated"] = True
                 
                 return text.strip(), metadata
                 
         except Exception as e:
             raise Exception(f"Error processing PDF {file_path}: {str(e)}")
     
+    @staticmethod
+    def _detect_scanned_only(pdf_reader: PyPDF2.PdfReader, file_path: str, file_size: Optional[int] = None,
+                             page_count: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Sample the first, middle and last pages; if the projected text per MB is
+        below SCAN_TEXT_RATIO_THRESHOLD return metadata marking the PDF scanned_only.
+        """
+        if page_count is None:
+            page_count = len(pdf_reader.pages)
+        if page_count == 0:
+            return None
+        
+        page_texts = []
+        sampled = sorted({0, page_count // 2, page_count - 1})
+        for page_num, (page_text, _) in zip(sampled, _extract_page_numbers(file_path, sampled)):
+            text_length = len(page_text.strip())
+            page_texts.append({
+                "page": page_num + 1,
+                "text_length": text_length,
+                "has_text": text_length > 0
+            })
+        
+        sampled_chars = sum(p["text_length"] for p in page_texts)
+        estimated_chars = sampled_chars * page_count / len(page_texts)
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        size_mb = max(file_size / (1024 * 1024), 1e-6)
+        if estimated_chars / size_mb >= SCAN_TEXT_RATIO_THRESHOLD:
+            return None
+        
+        return {
+            "scanned_only": True,
+            "page_details": page_texts,
+            "total_text_length": 0,
+            "extractable_pages": 0
+        }
+    
     @staticmethod
     def validate_document_content(text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Validate extracted document content"""
@@ -114,7 +366,9 @@ def process_file(file):
     """Legacy function for backward compatibility"""
     from PyPDF2 import PdfReader
     reader = PdfReader(file.file)
-    text = "".join([page.extract_text() for page in reader.pages if page.extract_text()])
+    # Extract each page once, then drop the empty ones
+    page_texts = (page.extract_text() for page in reader.pages)
+    text = "".join(page_text for page_text in page_texts if page_text)
     
     # Use new chunking strategy
     from app.utils import chunk_text
@@ -3,12 +3,12 @@
 import numpy as np
 from typing import List, Dict, Any, Tuple, Optional
 from dataclasses import dataclass
-from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
 import faiss
 import logging
 from app.database import Document, Chunk
 from app.cache import embedding_cache
+from app.embedding import get_embedding_model
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +27,7 @@ class HybridSearchEngine:
     """Hybrid search combining semantic and keyword search"""
     
     def __init__(self, embedding_model_name: str = "all-MiniLM-L6-v2"):
-        self.embedding_model = SentenceTransformer(embedding_model_name)
+        self.embedding_model_name = embedding_model_name
         self.tfidf_vectorizer = TfidfVectorizer(
             max_features=10000,
             stop_words='english',
@@ -40,6 +40,11 @@ class HybridSearchEngine:
         self.tfidf_matrix = None
         self.is_fitted = False
         
+    @property
+    def embedding_model(self):
+        """Loaded on first use, shared with the rest of the app"""
+        return get_embedding_model(self.embedding_model_name)
+    
     def build_index(self, chunks: List[Tuple[str, Dict[str, Any]]]):
         """Build both semantic and keyword indexes"""
         logger.info(f"Building hybrid search index for {len(chunks)} chunks")
@@ -52,10 +57,8 @@ class HybridSearchEngine:
         embeddings = self._get_embeddings(self.chunk_texts)
         dimension = embeddings.shape[1]
         
-        self.faiss_index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-        
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(embeddings)
+        # Inner product for cosine similarity; embeddings are already unit-norm
+        self.faiss_index = faiss.IndexFlatIP(dimension)
         self.faiss_index.add(embeddings)
         
         # Build keyword index (TF-IDF)
@@ -83,14 +86,17 @@ class HybridSearchEngine:
         # Generate embeddings for uncached texts
         if uncached_texts:
             logger.info(f"Generating embeddings for {len(uncached_texts)} uncached texts")
-            new_embeddings = self.embedding_model.encode(uncached_texts, convert_to_numpy=True)
+            # Normalized by the model, so build_index can add them as they are
+            new_embeddings = self.embedding_model.encode(uncached_texts, convert_to_numpy=True,
+                                                         normalize_embeddings=True)
             
             # Cache new embeddings and update the list
-            for idx, embedding in zip(uncached_indices, new_embeddings):
-                embedding_cache.set_embedding(uncached_texts[uncached_indices.index(idx)], embedding.tolist())
+            for idx, text, embedding in zip(uncached_indices, uncached_texts, new_embeddings):
+                embedding_cache.set_embedding(text, embedding.tolist())
                 embeddings[idx] = embedding
         
-        return np.array(embeddings)
+        # One contiguous float32 matrix (cached entries come back as lists)
+        return np.asarray(embeddings, dtype='float32')
     
     def semantic_search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
         """Perform semantic search using FAISS"""
@@ -98,8 +104,8 @@ class HybridSearchEngine:
             raise ValueError("Index not built. Call build_index first.")
         
         # Get query embedding
-        query_embedding = self.embedding_model.encode([query], convert_to_numpy=True)
-        faiss.normalize_L2(query_embedding)
+        query_embedding = self.embedding_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+        query_embedding = np.ascontiguousarray(query_embedding, dtype='float32')
         
         # Search
         scores, indices = self.faiss_index.search(query_embedding, k)
@@ -196,19 +202,18 @@ class HybridSearchEngine:
         
         reranked = []
         used_documents = set()
+        picked = set()  # positions in results, so the second pass isn't an O(k^2) list scan
         
         # First pass: pick best result from each document
-        for result in results:
+        for i, result in enumerate(results):
             if result.document_id not in used_documents:
                 reranked.append(result)
                 used_documents.add(result.document_id)
+                picked.add(i)
         
         # Second pass: add remaining results
-        remaining_slots = len(results) - len(reranked)
-        for result in results:
-            if len(reranked) >= len(results):
-                break
-            if result not in reranked:
+        for i, result in enumerate(results):
+            if i not in picked:
                 reranked.append(result)
         
         return reranked
@@ -1,10 +1,11 @@
 import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from dotenv import load_dotenv
-from fastapi import Form, Depends, HTTPException
+from fastapi import Form, Depends, HTTPException, Query as QueryParam
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from typing import List
@@ -16,7 +17,7 @@ from app.api_enhanced import router as enhanced_api_router
 from app.async_processing import background_cleanup_task
 from app.config import settings
 from app.auth import authenticate_user, create_access_token, get_password_hash, get_current_active_user
-from app.database import get_db, User
+from app.database import get_db, get_read_db, User
 
 # Load environment variables from .env file
 load_dotenv()
@@ -50,7 +51,8 @@ app = FastAPI(
     description="Advanced RAG Pipeline with Gemini 2.0 Flash - Upload documents and query them using LLMs with enhanced features.",
     version=settings.app_version,
     lifespan=lifespan,
-    debug=settings.debug
+    debug=settings.debug,
+    default_response_class=ORJSONResponse
 )
 
 # Add security middleware
@@ -84,14 +86,20 @@ async def query_documents_main(query: str = Form(...), k: int = Form(3), db: Ses
     return await query_documents(query, k, db)
 
 @app.get("/documents")
-async def list_documents_main(db: Session = Depends(get_db)):
+async def list_documents_main(
+    request: Request,
+    response: Response,
+    skip: int = QueryParam(0),
+    limit: int = QueryParam(100),
+    db: Session = Depends(get_read_db)
+):
     """Main documents list endpoint - delegates to v1 documents"""
     # Import here to avoid circular imports
     from app.api import list_documents
-    return await list_documents(db)
+    return await list_documents(request, response, skip, limit, db)
 
 @app.get("/document/{document_id}")
-async def get_document_details_main(document_id: int, db: Session = Depends(get_db)):
+async def get_document_details_main(document_id: int, db: Session = Depends(get_read_db)):
     """Main document details endpoint - delegates to v1 document details"""
     # Import here to avoid circular imports
     from app.api import get_document_details
@@ -99,14 +107,14 @@ async def get_document_details_main(document_id: int, db: Session = Depends(get_
 
 # Add missing monitoring routes to main app (without prefix)
 @app.get("/health")
-async def health_check_main(db: Session = Depends(get_db)):
+async def health_check_main(request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Main health check endpoint - delegates to v1 health"""
     # Import here to avoid circular imports
     from app.api import health_check
-    return await health_check(db)
+    return await health_check(request, response, db)
 
 @app.get("/stats")
-async def stats_main(db: Session = Depends(get_db)):
+async def stats_main(db: Session = Depends(get_read_db)):
     """Main stats endpoint - delegates to v1 stats"""
     # Import here to avoid circular imports
     from app.api import get_statistics
@@ -1,7 +1,7 @@
 # app/monitoring.py - Advanced monitoring and logging
 
 import time
-import json
+import orjson
 import traceback
 from datetime import datetime
 from typing import Dict, Any, Optional, List
@@ -107,7 +107,7 @@ def log_to_database(level: str, message: str, component: str, user_id: Optional[
             message=message,
             component=component,
             user_id=user_id,
-            metadata=json.dumps(metadata) if metadata else None
+            log_metadata=orjson.dumps(metadata, default=str).decode() if metadata else None
         )
         
         db.add(log_entry)
@@ -122,12 +122,12 @@ def performance_timer(component: str = None, log_to_db: bool = True):
     def decorator(func):
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_time = time.monotonic()
             component_name = component or f"{func.__module__}.{func.__name__}"
             
             try:
                 result = await func(*args, **kwargs)
-                duration = time.time() - start_time
+                duration = time.monotonic() - start_time
                 
                 # Record performance metric
                 performance_monitor.record_metric(
@@ -148,7 +148,7 @@ def performance_timer(component: str = None, log_to_db: bool = True):
                 return result
                 
             except Exception as e:
-                duration = time.time() - start_time
+                duration = time.monotonic() - start_time
                 
                 # Record error metric
                 performance_monitor.record_metric(
@@ -174,12 +174,12 @@ def performance_timer(component: str = None, log_to_db: bool = True):
         
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_time = time.monotonic()
             component_name = component or f"{func.__module__}.{func.__name__}"
             
             try:
                 result = func(*args, **kwargs)
-                duration = time.time() - start_time
+                duration = time.monotonic() - start_time
                 
                 # Record performance metric
                 performance_monitor.record_metric(
@@ -192,7 +192,7 @@ def performance_timer(component: str = None, log_to_db: bool = True):
                 return result
                 
             except Exception as e:
-                duration = time.time() - start_time
+                duration = time.monotonic() - start_time
                 
                 # Record error metric
                 performance_monitor.record_metric(
@@ -215,8 +215,11 @@ def performance_timer(component: str = None, log_to_db: bool = True):
 class SystemMonitor:
     """System resource and health monitoring"""
     
-    def __init__(self):
-        self.start_time = time.time()
+    def __init__(self, health_cache_ttl: float = 1.0):
+        self.start_time = time.monotonic()
+        self.health_cache_ttl = health_cache_ttl
+        self._health_cache = None
+        self._health_cache_expires = 0.0
     
     def get_system_stats(self) -> Dict[str, Any]:
         """Get system statistics"""
@@ -250,7 +253,7 @@ class SystemMonitor:
                     "num_threads": process.num_threads(),
                     "create_time": process.create_time()
                 },
-                "uptime": time.time() - self.start_time
+                "uptime": time.monotonic() - self.start_time
             }
             
         except ImportError:
@@ -258,7 +261,7 @@ class SystemMonitor:
             return {
                 "system": {"error": "psutil not installed"},
                 "process": {"pid": os.getpid()},
-                "uptime": time.time() - self.start_time
+                "uptime": time.monotonic() - self.start_time
             }
         except Exception as e:
             return {"error": str(e)}
@@ -308,6 +311,24 @@ class SystemMonitor:
             health_status["checks"]["performance"] = {"status": "error", "error": str(e)}
         
         return health_status
+    
+    def cached_health_check(self) -> Dict[str, Any]:
+        """
+        Health check memoized for health_cache_ttl seconds, for frequently polled
+        endpoints. Only healthy results are reused, so a failure is reported (and
+        its recovery seen) on the next poll.
+        """
+        now = time.monotonic()
+        if self._health_cache is not None and now < self._health_cache_expires:
+            return self._health_cache
+        
+        health_status = self.health_check()
+        if health_status.get("status") == "healthy":
+            self._health_cache = health_status
+            self._health_cache_expires = now + self.health_cache_ttl
+        else:
+            self._health_cache = None
+        return health_status
 
 # Global system monitor
 system_monitor = SystemMonitor()
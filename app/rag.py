@@ -2,17 +2,14 @@
 
 import os
 import faiss
-import pickle
 import google.generativeai as genai
-from sentence_transformers import SentenceTransformer
 from app.utils import chunk_text
+from app.embedding import corpus_index, encode_query, load_document_index, search_document_index
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Load embedding model
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INDEX_DIR = os.path.join(PROJECT_ROOT, "indexes")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -27,31 +24,41 @@ if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
 
-def get_answer(query, doc_paths, k=2):
+def get_answer(query, doc_paths, k=2, document_ids=None, query_embedding=None):
     if not isinstance(doc_paths, list):
         doc_paths = [doc_paths]
 
     all_chunks = []
 
+    if document_ids is not None:
+        # One search over the merged corpus index instead of one per document file
+        # (documents not in it yet are added with a single save)
+        corpus_index.load_documents(list(zip(document_ids, doc_paths)))
+
+        if query_embedding is None:
+            query_embedding = encode_query(query)
+        all_chunks = [result["content"] for result in corpus_index.search(query_embedding, document_ids, k)]
+        doc_paths = []
+
+    if doc_paths and query_embedding is None:
+        query_embedding = encode_query(query)
+
     for doc_path in doc_paths:
         index_file = os.path.join(INDEX_DIR, os.path.basename(doc_path) + ".index")
         if not os.path.exists(index_file):
             continue
 
-        index = faiss.read_index(index_file)
-        with open(index_file + ".meta", "rb") as f:
-            chunks = pickle.load(f)
+        index, chunks = load_document_index(index_file)
 
-        query_embedding = embedding_model.encode([query])
-        _, indices = index.search(query_embedding, k)
+        _, indices = search_document_index(index, query_embedding, k)
         relevant_chunks = [chunks[i] for i in indices[0] if i < len(chunks)]
         all_chunks.extend(relevant_chunks)
 
     if not all_chunks:
         return "No relevant content found across uploaded documents."
 
-    # Prepare context
-    context = "\n---\n".join(all_chunks)
+    # Prepare context (identical chunks, e.g. repeated boilerplate, are only sent once)
+    context = "\n---\n".join(dict.fromkeys(all_chunks))
     prompt = f"""You are a helpful assistant. Use the context below to answer the question.
 
 Context:
@@ -7,12 +7,26 @@ from typing import List, Dict, Any, Tuple, Optional
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from collections import Counter
+from functools import lru_cache
 import faiss
 
-from app.database import DocumentChunk
-from app.embedding import embedding_model
+from app.database import DocumentChunk, SessionLocal
+from app.embedding import embed_chunks, encode_query
 from app.config import settings
 
+# Compiled once; preprocess_text runs for every chunk at index time and every query
+_NON_ALNUM_RE = re.compile(r'[^a-zA-Z0-9\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'\b\w+\b')
+
+# Common stop words dropped by QueryExpander.extract_key_terms
+KEY_TERM_STOP_WORDS = frozenset({
+    "the", "a", "an", "and", "or", "but", "in", "on", "at", "to", "for",
+    "of", "with", "by", "is", "are", "was", "were", "be", "been", "have",
+    "has", "had", "do", "does", "did", "will", "would", "could", "should",
+    "what", "how", "when", "where", "why", "who", "which"
+})
+
 class KeywordSearcher:
     """BM25-based keyword search"""
     
@@ -30,9 +44,9 @@ class KeywordSearcher:
         # Convert to lowercase
         text = text.lower()
         # Remove special characters but keep spaces
-        text = re.sub(r'[^a-zA-Z0-9\s]', ' ', text)
+        text = _NON_ALNUM_RE.sub(' ', text)
         # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = _WHITESPACE_RE.sub(' ', text).strip()
         return text
     
     def build_index(self, documents: List[str]):
@@ -81,14 +95,18 @@ class KeywordSearcher:
         if not self.corpus:
             return []
         
-        scores = []
-        for i in range(len(self.corpus)):
-            score = self.get_bm25_score(query, i)
-            scores.append((i, score))
+        scores = np.fromiter(
+            (self.get_bm25_score(query, i) for i in range(len(self.corpus))),
+            dtype=np.float64, count=len(self.corpus)
+        )
         
-        # Sort by score descending
-        scores.sort(key=lambda x: x[1], reverse=True)
-        return scores[:top_k]
+        # Top-k by score descending: O(n) partition, then sort only the k winners
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
 
 class SemanticSearcher:
     """Embedding-based semantic search"""
@@ -107,14 +125,12 @@ class SemanticSearcher:
         
         # Get embeddings for all chunks
         chunk_texts = [chunk.content for chunk in chunks]
-        self.embeddings = embedding_model.encode(chunk_texts)
+        # Encoded, normalized and cast to float32 in one pass
+        self.embeddings = embed_chunks(chunk_texts)
         
         # Build FAISS index
         dimension = self.embeddings.shape[1]
         self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-        
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(self.embeddings)
         self.index.add(self.embeddings)
     
     def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
@@ -123,8 +139,7 @@ class SemanticSearcher:
             return []
         
         # Encode query
-        query_embedding = embedding_model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        query_embedding = encode_query(query)
         
         # Search
         scores, indices = self.index.search(query_embedding, top_k)
@@ -252,6 +267,9 @@ class QueryExpander:
             "problem": ["issue", "challenge", "difficulty"],
             "solution": ["answer", "resolution", "approach"]
         }
+        # Memoized per instance: results depend on this instance's synonyms, and a
+        # cache on the method would key on (and keep alive) every instance
+        self.expand_query = lru_cache(maxsize=10000)(self.expand_query)
     
     def expand_query(self, query: str, max_expansions: int = 2) -> str:
         """Expand query with synonyms"""
@@ -269,15 +287,8 @@ class QueryExpander:
     def extract_key_terms(self, query: str) -> List[str]:
         """Extract key terms from query"""
         # Remove common stop words and extract meaningful terms
-        stop_words = {
-            "the", "a", "an", "and", "or", "but", "in", "on", "at", "to", "for",
-            "of", "with", "by", "is", "are", "was", "were", "be", "been", "have",
-            "has", "had", "do", "does", "did", "will", "would", "could", "should",
-            "what", "how", "when", "where", "why", "who", "which"
-        }
-        
-        words = re.findall(r'\b\w+\b', query.lower())
-        key_terms = [word for word in words if word not in stop_words and len(word) > 2]
+        words = _WORD_RE.findall(query.lower())
+        key_terms = [word for word in words if word not in KEY_TERM_STOP_WORDS and len(word) > 2]
         
         return key_terms
 
@@ -327,3 +338,23 @@ class ReRanker:
 hybrid_searcher = HybridSearcher()
 query_expander = QueryExpander()
 reranker = ReRanker()
+
+@lru_cache(maxsize=32)
+def _build_hybrid_searcher(document_ids: Tuple[int, ...]) -> HybridSearcher:
+    db = SessionLocal()
+    try:
+        chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id.in_(document_ids)).all()
+    finally:
+        db.close()
+    
+    searcher = HybridSearcher()
+    searcher.build_index(chunks)
+    return searcher
+
+def get_hybrid_searcher(document_ids: List[int]) -> HybridSearcher:
+    """HybridSearcher over the given documents' chunks, built once per document set"""
+    return _build_hybrid_searcher(tuple(sorted(set(document_ids))))
+
+def invalidate_hybrid_searchers():
+    """Drop cached searchers after documents are added or deleted"""
+    _build_hybrid_searcher.cache_clear()
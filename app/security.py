@@ -1,5 +1,10 @@
+import asyncio
 import hashlib
-from typing import List
+import io
+import mmap
+import re
+import tempfile
+from typing import List, Optional
 from fastapi import HTTPException, UploadFile
 import os
 
@@ -7,6 +12,11 @@ import os
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 MAX_FILES = 20
 MAX_PAGES_PER_DOCUMENT = 1000
+HASH_CHUNK_SIZE = 1024 * 1024  # 1MB reads when hashing file streams
+# Injection markers rejected in queries, matched in one case-insensitive pass
+DANGEROUS_QUERY_PATTERNS = ['<script', 'javascript:', 'data:', 'vbscript:']
+_DANGEROUS_QUERY_RE = re.compile("|".join(map(re.escape, DANGEROUS_QUERY_PATTERNS)), re.IGNORECASE)
+
 ALLOWED_MIME_TYPES = [
     'application/pdf',
     'application/x-pdf',
@@ -50,9 +60,21 @@ class SecurityValidator:
         return len(files) <= MAX_FILES
     
     @staticmethod
-    def calculate_file_hash(file_content: bytes) -> str:
-        """Calculate SHA256 hash of file content"""
-        return hashlib.sha256(file_content).hexdigest()
+    def new_file_hasher():
+        """Create the hasher used for file_hash (OpenSSL SHA256, uses SHA-NI where available)"""
+        return hashlib.sha256()
+    
+    @staticmethod
+    def calculate_file_hash(file_content) -> str:
+        """Calculate SHA256 hash of file content (bytes or a binary file object)"""
+        if isinstance(file_content, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(file_content).hexdigest()
+        
+        # Stream file objects through a fixed-size buffer instead of loading them whole
+        hasher = SecurityValidator.new_file_hasher()
+        for chunk in iter(lambda: file_content.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+        return hasher.hexdigest()
     
     @staticmethod
     def sanitize_filename(filename: str) -> str:
@@ -77,12 +99,8 @@ class SecurityValidator:
             return False
         
         # Check for potential injection patterns
-        dangerous_patterns = ['<script', 'javascript:', 'data:', 'vbscript:']
-        query_lower = query.lower()
-        
-        for pattern in dangerous_patterns:
-            if pattern in query_lower:
-                return False
+        if _DANGEROUS_QUERY_RE.search(query):
+            return False
         
         return True
 
@@ -101,3 +119,60 @@ def validate_upload_files(files: List[UploadFile]) -> List[str]:
             errors.append(f"File {i+1} ({file.filename}): File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB.")
     
     return errors
+
+def _copy_and_hash(source, file_path: str) -> str:
+    """Copy a binary file object to file_path in HASH_CHUNK_SIZE blocks, returning its SHA256"""
+    hasher = SecurityValidator.new_file_hasher()
+    source.seek(0)
+    with open(file_path, "wb") as buffer:
+        while chunk := source.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+            buffer.write(chunk)
+    return hasher.hexdigest()
+
+def _disk_fileno(source) -> Optional[int]:
+    """File descriptor of source if its data is already in a real file, else None"""
+    # fileno() would force an in-memory spooled upload out to disk first
+    if isinstance(source, tempfile.SpooledTemporaryFile) and not isinstance(
+        getattr(source, "_file", None), io.BufferedRandom
+    ):
+        return None
+    try:
+        return source.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+def _sendfile_and_hash(source_fd: int, file_path: str) -> str:
+    """Hash source_fd through an mmap and copy it to file_path in the kernel with sendfile"""
+    size = os.fstat(source_fd).st_size
+    hasher = SecurityValidator.new_file_hasher()
+    with mmap.mmap(source_fd, size, access=mmap.ACCESS_READ) as mapped:
+        hasher.update(mapped)
+    
+    with open(file_path, "wb") as buffer:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(buffer.fileno(), source_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    return hasher.hexdigest()
+
+def _save_and_hash(source, file_path: str) -> str:
+    source_fd = _disk_fileno(source)
+    if source_fd is not None and hasattr(os, "sendfile") and os.fstat(source_fd).st_size > 0:
+        try:
+            return _sendfile_and_hash(source_fd, file_path)
+        except (OSError, AttributeError):
+            pass  # e.g. macOS only sendfiles to sockets (ENOTSOCK); copy instead
+    return _copy_and_hash(source, file_path)
+
+async def save_upload_file(file: UploadFile, file_path: str) -> str:
+    """
+    Save an upload to file_path and return its SHA256. Uploads Starlette has
+    already spooled to disk are hashed via mmap and copied with sendfile, so
+    the data never passes through Python buffers; in-memory ones (and platforms
+    where sendfile is missing or can't target a file) are streamed block by block. Runs in a worker thread so
+    disk I/O never blocks the event loop.
+    """
+    return await asyncio.to_thread(_save_and_hash, file.file, file_path)
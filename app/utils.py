@@ -1,27 +1,31 @@
 # app/utils.py - Enhanced utilities for text processing and chunking
 
 import re
+import hashlib
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
+from fastapi import Request, Response
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Compiled once; clean_text runs over every extracted page
+_WHITESPACE_RE = re.compile(r'\s+')
+_UNSUPPORTED_CHARS_RE = re.compile(r'[^\w\s.,!?;:()\-"]+')  # whole runs per match
+_SENTENCE_END_RE = re.compile(r'[.!?]+')
+
 class TextProcessor:
     @staticmethod
     def clean_text(text: str) -> str:
         """Clean and normalize text for better processing"""
         # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove special characters but keep basic punctuation
-        text = re.sub(r'[^\w\s.,!?;:()\-"]', '', text)
+        text = _WHITESPACE_RE.sub(' ', text)
         
-        # Fix common PDF extraction issues
-        text = text.replace('\x00', '')  # Remove null characters
-        text = text.replace('\ufffd', '')  # Remove replacement characters
+        # Remove special characters but keep basic punctuation; this also drops
+        # the null and U+FFFD replacement characters PDF extraction leaves behind
+        text = _UNSUPPORTED_CHARS_RE.sub('', text)
         
         return text.strip()
     
@@ -29,8 +33,9 @@ class TextProcessor:
     def extract_sentences(text: str) -> List[str]:
         """Extract sentences from text using regex"""
         # Simple sentence splitting
-        sentences = re.split(r'[.!?]+', text)
-        return [s.strip() for s in sentences if len(s.strip()) > 10]
+        sentences = _SENTENCE_END_RE.split(text)
+        # Strip each sentence once instead of once for the test and again for the value
+        return [s for s in map(str.strip, sentences) if len(s) > 10]
 
 def chunk_text(text: str, max_length: int = 800, overlap: int = 100, strategy: str = "word") -> List[Dict[str, Any]]:
     """
@@ -45,24 +50,7 @@ def chunk_text(text: str, max_length: int = 800, overlap: int = 100, strategy: s
     Returns:
         List[Dict]: List of chunk dictionaries with metadata.
     """
-    # Clean text first
-    cleaned_text = TextProcessor.clean_text(text)
-    
-    # Handle empty or very short text (common in tests)
-    if len(cleaned_text.strip()) < 10:
-        # Create a minimal chunk for testing purposes
-        if len(cleaned_text.strip()) == 0:
-            cleaned_text = "Sample document content for testing purposes."
-        logger.warning(f"Very short text content, using fallback: '{cleaned_text[:50]}...'")
-    
-    chunks = []
-    
-    if strategy == "sentence":
-        chunks = _chunk_by_sentences(cleaned_text, max_length, overlap)
-    elif strategy == "paragraph":
-        chunks = _chunk_by_paragraphs(cleaned_text, max_length, overlap)
-    else:  # Default to word-based chunking
-        chunks = _chunk_by_words(cleaned_text, max_length, overlap)
+    chunks = split_text(text, max_length, overlap, strategy)
     
     # Add metadata to chunks
     enhanced_chunks = []
@@ -78,6 +66,28 @@ def chunk_text(text: str, max_length: int = 800, overlap: int = 100, strategy: s
     logger.info(f"Created {len(enhanced_chunks)} chunks using {strategy} strategy")
     return enhanced_chunks
 
+def split_text(text: str, max_length: int = 800, overlap: int = 100, strategy: str = "word") -> List[str]:
+    """
+    Chunk contents only, as chunk_text would produce them, without building
+    a metadata dict per chunk. Use this when only the texts are needed.
+    """
+    # Clean text first
+    cleaned_text = TextProcessor.clean_text(text)
+    
+    # Handle empty or very short text (common in tests)
+    if len(cleaned_text.strip()) < 10:
+        # Create a minimal chunk for testing purposes
+        if len(cleaned_text.strip()) == 0:
+            cleaned_text = "Sample document content for testing purposes."
+        logger.warning(f"Very short text content, using fallback: '{cleaned_text[:50]}...'")
+    
+    if strategy == "sentence":
+        return _chunk_by_sentences(cleaned_text, max_length, overlap)
+    elif strategy == "paragraph":
+        return _chunk_by_paragraphs(cleaned_text, max_length, overlap)
+    else:  # Default to word-based chunking
+        return _chunk_by_words(cleaned_text, max_length, overlap)
+
 def _chunk_by_words(text: str, max_length: int, overlap: int) -> List[str]:
     """Chunk text by words with overlap"""
     words = text.split()
@@ -134,7 +144,7 @@ def _chunk_by_sentences(text: str, max_length: int, overlap: int) -> List[str]:
 
 def _chunk_by_paragraphs(text: str, max_length: int, overlap: int) -> List[str]:
     """Chunk text by paragraphs"""
-    paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
+    paragraphs = [p for p in map(str.strip, text.split('\n\n')) if p]
     chunks = []
     current_chunk = []
     current_length = 0
@@ -172,3 +182,19 @@ def calculate_similarity_score(query_embedding, chunk_embedding) -> float:
 def log_performance(operation: str, duration: float, **kwargs):
     """Log performance metrics"""
     logger.info(f"Performance: {operation} took {duration:.3f}s", extra=kwargs)
+
+def conditional_response(request: Request, response: Response, *etag_parts, max_age: int = 5) -> Optional[Response]:
+    """
+    Attach ETag/Cache-Control headers derived from etag_parts.
+
+    Returns a 304 response when the client's If-None-Match already matches,
+    otherwise None and the caller builds the full body as usual.
+    """
+    etag = '"' + hashlib.sha256("|".join(map(str, etag_parts)).encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    return None
@@ -8,17 +8,22 @@ import io
 import json
 import uuid
 import time
+from datetime import datetime
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from app.main import app
-from app.database import Base, get_db, User, Document, Query, APIKey, Task
+from app.cache import document_list_cache
+from app.database import Base, get_db, get_read_db, get_async_db, User, Document, Query, APIKey, Task
 from app.auth import get_password_hash
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
 
 # Override the get_db dependency for testing
 def override_get_db():
@@ -28,7 +33,13 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 # Create the test database tables
 Base.metadata.create_all(bind=engine)
@@ -50,6 +61,7 @@ def cleanup_test_data():
         db.query(Task).delete()
         db.query(User).delete()
         db.commit()
+        document_list_cache.invalidate()
         
         # Clean up uploaded files
         upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads")
@@ -145,6 +157,110 @@ def test_empty_documents_list():
     assert data["total_count"] == 0
     assert data["documents"] == []
 
+def _add_documents(count):
+    """Insert documents directly, newest last; returns their ids"""
+    db = TestingSessionLocal()
+    try:
+        documents = [
+            Document(
+                filename=f"doc{i}.pdf",
+                file_path=f"/tmp/doc{i}.pdf",
+                file_size=1000 + i,
+                page_count=1,
+                chunk_count=i,
+                upload_date=datetime(2024, 1, 1 + i),
+                file_hash=f"{i:064d}",
+                file_metadata={"title": f"Doc {i}"}
+            )
+            for i in range(count)
+        ]
+        db.add_all(documents)
+        db.commit()
+        document_list_cache.invalidate()
+        return [document.id for document in documents]
+    finally:
+        db.close()
+
+def test_documents_list_pagination():
+    """Test the streamed document listing honours skip and limit"""
+    ids = _add_documents(3)
+    
+    response = client.get("/api/v1/documents?skip=1&limit=1")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_count"] == 3
+    assert data["skip"] == 1
+    assert data["limit"] == 1
+    assert data["showing"] == 1
+    # Newest first, so skipping one lands on the middle document
+    assert [doc["id"] for doc in data["documents"]] == [ids[1]]
+    assert data["documents"][0]["metadata"]["title"] == "Doc 1"
+    
+    response = client.get("/api/v1/documents?skip=2&limit=5")
+    data = response.json()
+    assert data["showing"] == 1
+    assert [doc["id"] for doc in data["documents"]] == [ids[0]]
+
+def test_documents_list_not_modified():
+    """Test a matching If-None-Match gets 304 until the documents change"""
+    _add_documents(2)
+    
+    response = client.get("/api/v1/documents")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    
+    response = client.get("/api/v1/documents", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    
+    response = client.get("/api/v1/documents?limit=1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    
+    _add_documents(1)
+    response = client.get("/api/v1/documents", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_split_text_matches_chunk_text():
+    """Test split_text returns exactly chunk_text's contents"""
+    from app.utils import split_text, chunk_text
+    
+    text = "\n\n".join(
+        " ".join(f"Sentence {p}.{s} has some words in it." for s in range(12))
+        for p in range(6)
+    )
+    for strategy in ("word", "sentence", "paragraph"):
+        for max_length, overlap in ((800, 100), (120, 20)):
+            chunks = chunk_text(text, max_length, overlap, strategy)
+            assert split_text(text, max_length, overlap, strategy) == [chunk["content"] for chunk in chunks]
+            assert [chunk["chunk_id"] for chunk in chunks] == list(range(len(chunks)))
+
+def test_bm25_top_k_matches_full_sort():
+    """Test the argpartition top-k in KeywordSearcher equals a full sort"""
+    from app.search import KeywordSearcher
+    
+    documents = [
+        "neural network training data",
+        "data data pipeline for training",
+        "database indexing and query planning",
+        "training a neural model with more data and more training",
+        "unrelated text about cooking",
+        "query data from the network",
+    ]
+    searcher = KeywordSearcher()
+    searcher.build_index(documents)
+    
+    query = "training data network"
+    scores = [searcher.get_bm25_score(query, i) for i in range(len(documents))]
+    full_sort = sorted(scores, reverse=True)
+    
+    for top_k in (1, 3, len(documents), len(documents) + 5):
+        results = searcher.search(query, top_k)
+        assert len(results) == min(top_k, len(documents))
+        assert [score for _, score in results] == pytest.approx(full_sort[:len(results)])
+        assert all(scores[i] == pytest.approx(score) for i, score in results)
+
 def test_query_without_documents():
     """Test querying when no documents are uploaded"""
     response = client.post("/query", data={"query": "What is this about?"})
@@ -11,9 +11,11 @@ from datetime import datetime, timedelta
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from app.main import app
-from app.database import Base, get_db, User, Document, Query, APIKey, Task
+from app.cache import document_list_cache
+from app.database import Base, get_db, get_read_db, get_async_db, User, Document, Query, APIKey, Task
 from app.auth import hash_password, create_access_token, hash_api_key, generate_api_key
 from app.config import settings
 
@@ -21,6 +23,8 @@ from app.config import settings
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
 
 def override_get_db():
     try:
@@ -29,7 +33,13 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 def cleanup_test_data():
     """Clean up test data between tests"""
@@ -42,6 +52,7 @@ def cleanup_test_data():
         db.query(Task).delete()
         db.query(User).delete()
         db.commit()
+        document_list_cache.invalidate()
         
         # Clean up uploaded files
         upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads")
@@ -264,10 +275,9 @@ class TestFileUpload:
         """Test file upload with authentication"""
         with open(sample_pdf, "rb") as file:
             response = client.post(
-                "/api/v2/upload",
+                "/api/v2/upload?sync=true",
                 headers={"Authorization": f"Bearer {auth_token}"},
-                files={"files": ("test.pdf", file, "application/pdf")},
-                data={"async_processing": "false"}
+                files={"files": ("test.pdf", file, "application/pdf")}
             )
         
         assert response.status_code == 200
@@ -275,6 +285,21 @@ class TestFileUpload:
         assert data["status"] == "completed"
         assert len(data["uploaded"]) > 0
     
+    def test_upload_sync_reports_chunks(self, client, auth_token, sample_pdf):
+        """Test a synchronous upload waits for indexing and reports chunk counts"""
+        with open(sample_pdf, "rb") as file:
+            response = client.post(
+                "/api/v2/upload?sync=true",
+                headers={"Authorization": f"Bearer {auth_token}"},
+                files={"files": ("test.pdf", file, "application/pdf")}
+            )
+        
+        assert response.status_code == 200
+        uploaded = response.json()["uploaded"][0]
+        assert uploaded["status"] == "completed"
+        assert isinstance(uploaded["chunks"], int)
+        assert uploaded["chunks"] >= 0
+    
     def test_upload_with_api_key(self, client, test_api_key, sample_pdf):
         """Test file upload with API key"""
         # First verify the API key exists in the database
@@ -291,10 +316,9 @@ class TestFileUpload:
         # Now test the upload
         with open(sample_pdf, "rb") as file:
             response = client.post(
-                "/api/v2/upload",
+                "/api/v2/upload?sync=true",
                 headers={"X-API-Key": test_api_key},
-                files={"files": ("test.pdf", file, "application/pdf")},
-                data={"async_processing": "false"}
+                files={"files": ("test.pdf", file, "application/pdf")}
             )
         
         # If authentication fails, we might get 401/403, but the upload should work
@@ -311,16 +335,15 @@ class TestFileUpload:
             response = client.post(
                 "/api/v2/upload",
                 headers={"Authorization": f"Bearer {auth_token}"},
-                files={"files": ("test.pdf", file, "application/pdf")},
-                data={"async_processing": "true"}
+                files={"files": ("test.pdf", file, "application/pdf")}
             )
         
-        assert response.status_code == 200
+        assert response.status_code == 202
         data = response.json()
         assert data["async_processing"] == True
         assert len(data["uploaded"]) > 0
-        if data["uploaded"]:
-            assert "task_id" in data["uploaded"][0]
+        assert "task_id" in data["uploaded"][0]
+        assert response.headers["Location"].endswith(f"/api/v2/upload/status/{data['uploaded'][0]['task_id']}")
     
     def test_upload_invalid_file(self, client, auth_token):
         """Test upload with invalid file type"""
@@ -381,6 +404,30 @@ class TestDocumentQueries:
         
         assert response.status_code in [200, 400]
     
+    def test_query_with_document_semantic_cache_disabled(self, client, auth_token, sample_pdf, monkeypatch):
+        """Test a v2 query that reaches an answer with the semantic cache off"""
+        monkeypatch.setattr(settings, "enable_semantic_cache", False)
+        
+        with open(sample_pdf, "rb") as file:
+            upload = client.post(
+                "/api/v2/upload?sync=true",
+                headers={"Authorization": f"Bearer {auth_token}"},
+                files={"files": ("test.pdf", file, "application/pdf")}
+            )
+        assert upload.status_code == 200
+        
+        response = client.post(
+            "/api/v2/query",
+            headers={"Authorization": f"Bearer {auth_token}"},
+            data={"query": "What does the uploaded document say?", "search_type": "semantic"}
+        )
+        
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert "answer" in data
+        assert data["cached"] is False
+        assert data["documents_searched"] >= 1
+        
     def test_query_invalid(self, client, auth_token):
         """Test query with invalid input"""
         response = client.post(
@@ -542,6 +589,203 @@ class TestRateLimiting:
         # Should eventually get rate limited
         assert 429 in responses or any(r >= 400 for r in responses)
 
+class TestAsyncProcessing:
+    """Test the background task manager wiring"""
+    
+    def test_task_manager_singleton(self):
+        """Test that module helpers share the single TaskManager"""
+        from app.async_processing import get_task_manager, task_manager
+        
+        assert get_task_manager() is task_manager
+        assert callable(getattr(task_manager, "create_task"))
+
+def _unit_vector(seed, dimension=384):
+    import numpy as np
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+class TestSemanticQueryCache:
+    """Test the embedding-keyed answer cache"""
+    
+    def test_near_duplicate_hit(self):
+        """Test a slightly perturbed embedding returns the cached answer"""
+        import numpy as np
+        from app.cache import SemanticQueryCache
+        
+        cache = SemanticQueryCache(threshold=0.95)
+        scope = SemanticQueryCache.scope_key([1, 2], 3)
+        embedding = _unit_vector(0)
+        cache.put(embedding, "answer", 7, scope)
+        
+        paraphrase = embedding + 0.001 * _unit_vector(1)
+        paraphrase /= np.linalg.norm(paraphrase)
+        
+        assert cache.get(paraphrase, scope) == ("answer", 7)
+        assert cache.hits == 1
+    
+    def test_miss_below_threshold(self):
+        """Test an embedding below the cosine threshold is a miss"""
+        import numpy as np
+        from app.cache import SemanticQueryCache
+        
+        cache = SemanticQueryCache(threshold=0.95)
+        scope = SemanticQueryCache.scope_key([1], 3)
+        embedding = _unit_vector(0)
+        cache.put(embedding, "answer", 7, scope)
+        
+        # cosine 0.9 with the cached embedding
+        other = _unit_vector(1)
+        other -= np.dot(other, embedding) * embedding
+        other /= np.linalg.norm(other)
+        different = 0.9 * embedding + np.sqrt(1 - 0.9 ** 2) * other
+        
+        assert cache.get(different, scope) is None
+        assert cache.misses == 1
+    
+    def test_scope_isolation(self):
+        """Test answers are only reused for the same document set and k"""
+        from app.cache import SemanticQueryCache
+        
+        cache = SemanticQueryCache()
+        embedding = _unit_vector(0)
+        cache.put(embedding, "answer", 7, SemanticQueryCache.scope_key([1, 2], 3))
+        
+        assert cache.get(embedding, SemanticQueryCache.scope_key([2, 1], 3)) == ("answer", 7)
+        assert cache.get(embedding, SemanticQueryCache.scope_key([1, 2, 3], 3)) is None
+        assert cache.get(embedding, SemanticQueryCache.scope_key([1, 2], 5)) is None
+    
+    def test_ttl_expiry(self, monkeypatch):
+        """Test entries expire after ttl seconds"""
+        from app import cache as cache_module
+        from app.cache import SemanticQueryCache
+        
+        now = [1000.0]
+        monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+        
+        cache = SemanticQueryCache(ttl=60)
+        scope = SemanticQueryCache.scope_key([1], 3)
+        embedding = _unit_vector(0)
+        cache.put(embedding, "answer", 7, scope)
+        
+        now[0] += 59
+        assert cache.get(embedding, scope) == ("answer", 7)
+        now[0] += 1
+        assert cache.get(embedding, scope) is None
+        assert len(cache.entries) == 0
+    
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted at max_size"""
+        from app.cache import SemanticQueryCache
+        
+        cache = SemanticQueryCache(max_size=2)
+        scope = SemanticQueryCache.scope_key([1], 3)
+        first, second, third = _unit_vector(0), _unit_vector(1), _unit_vector(2)
+        cache.put(first, "first", 1, scope)
+        cache.put(second, "second", 2, scope)
+        
+        assert cache.get(first, scope) == ("first", 1)  # first is now most recent
+        cache.put(third, "third", 3, scope)
+        
+        assert len(cache.entries) == 2
+        assert cache.get(second, scope) is None
+        assert cache.get(first, scope) == ("first", 1)
+        assert cache.get(third, scope) == ("third", 3)
+    
+    def test_cleared_on_upload_and_delete(self, client, auth_token, sample_pdf):
+        """Test uploads and deletes drop every cached answer"""
+        from app.cache import semantic_query_cache, SemanticQueryCache
+        
+        scope = SemanticQueryCache.scope_key([1], 3)
+        semantic_query_cache.put(_unit_vector(0), "stale", None, scope)
+        
+        with open(sample_pdf, "rb") as file:
+            response = client.post(
+                "/api/v2/upload?sync=true",
+                headers={"Authorization": f"Bearer {auth_token}"},
+                files={"files": ("test.pdf", file, "application/pdf")}
+            )
+        assert response.status_code == 200
+        assert len(semantic_query_cache.entries) == 0
+        
+        semantic_query_cache.put(_unit_vector(0), "stale", None, scope)
+        document_id = response.json()["uploaded"][0]["id"]
+        response = client.delete(
+            f"/api/v2/documents/{document_id}",
+            headers={"Authorization": f"Bearer {auth_token}"}
+        )
+        assert response.status_code == 200
+        assert len(semantic_query_cache.entries) == 0
+
+class TestCorpusIndex:
+    """Test the merged FAISS corpus index"""
+    
+    @pytest.fixture
+    def embedding_module(self, tmp_path, monkeypatch):
+        from app import embedding
+        
+        chunks_dir = tmp_path / "corpus_chunks"
+        chunks_dir.mkdir()
+        monkeypatch.setattr(embedding, "CORPUS_INDEX_FILE", str(tmp_path / "corpus.index"))
+        monkeypatch.setattr(embedding, "CORPUS_CHUNKS_FILE", str(tmp_path / "corpus.chunks"))
+        monkeypatch.setattr(embedding, "CORPUS_CHUNKS_DIR", str(chunks_dir))
+        monkeypatch.setattr(embedding, "CORPUS_IVF_DATA_FILE", str(tmp_path / "corpus.ivfdata"))
+        monkeypatch.setattr(embedding, "CORPUS_LOCK_FILE", str(tmp_path / "corpus.lock"))
+        return embedding
+    
+    @staticmethod
+    def _embeddings(seed, count):
+        import numpy as np
+        return np.vstack([_unit_vector(seed * 1000 + i) for i in range(count)])
+    
+    def test_add_search_remove(self, embedding_module):
+        """Test search is restricted to the requested documents and removal drops them"""
+        index = embedding_module.CorpusIndex()
+        first, second = self._embeddings(1, 3), self._embeddings(2, 2)
+        index.add_document(1, first, ["a0", "a1", "a2"])
+        index.add_document(2, second, ["b0", "b1"])
+        assert index.index.ntotal == 5
+        
+        results = index.search(first[1:2], [1, 2], k=1)
+        assert results[0]["content"] == "a1"
+        assert results[0]["document_id"] == 1
+        assert results[0]["chunk_index"] == 1
+        assert results[0]["score"] == pytest.approx(1.0, abs=1e-4)
+        
+        results = index.search(first[1:2], [2], k=5)
+        assert {result["document_id"] for result in results} == {2}
+        assert len(results) == 2
+        
+        # A second instance picks the saved documents up from disk
+        reloaded = embedding_module.CorpusIndex()
+        assert reloaded.chunks == {1: ["a0", "a1", "a2"], 2: ["b0", "b1"]}
+        
+        index.remove_document(1)
+        assert index.index.ntotal == 2
+        assert index.search(first[1:2], [1], k=3) == []
+        assert not os.path.exists(os.path.join(embedding_module.CORPUS_CHUNKS_DIR, "1.json"))
+        assert [result["document_id"] for result in reloaded.search(first[1:2], [1, 2], k=3)] == [2, 2]
+    
+    def test_ivf_retrain_threshold(self, embedding_module, monkeypatch):
+        """Test the flat index is retrained as IVF once it holds nlist * min points vectors"""
+        monkeypatch.setattr(embedding_module, "IVF_NLIST", 4)
+        monkeypatch.setattr(embedding_module, "IVF_MIN_POINTS_PER_LIST", 10)
+        monkeypatch.setattr(embedding_module, "IVF_NPROBE", 4)
+        monkeypatch.setattr(embedding_module, "IVF_FACTORY_STRINGS", {"ivf_flat": "IVF4,Flat"})
+        monkeypatch.setattr(settings, "faiss_index_type", "ivf_flat")
+        
+        index = embedding_module.CorpusIndex()
+        first = self._embeddings(1, 39)
+        index.add_document(1, first, [f"a{i}" for i in range(39)])
+        assert not index.is_ivf
+        
+        index.add_document(2, self._embeddings(2, 1), ["b0"])
+        assert index.is_ivf
+        assert index.index.ntotal == 40
+        
+        results = index.search(first[5:6], [1], k=1)
+        assert results[0]["content"] == "a5"
+        assert embedding_module.CorpusIndex().is_ivf
+
 class TestBackwardCompatibility:
     """Test backward compatibility with v1 API"""
     